@@ -1,16 +1,39 @@
 from collections import defaultdict
+import numpy as np
 from compare_mt import corpus_utils
 
-def _count_ngram(sent, order):
-  gram_pos = dict()
-  for i in range(order):
-    gram_pos[i+1] = defaultdict(lambda: [])
-  for i, word in enumerate(sent):
-    for j in range(min(i+1, order)):
-      gram_pos[j+1][word].append(i-j)
-      word = sent[i-j-1] + ' ' + word
+def _count_ngram(gram_ids):
+  gram_pos = defaultdict(lambda: [])
+  for i, gram_id in enumerate(gram_ids):
+    gram_pos[gram_id].append(i)
   return gram_pos
 
+class _NgramPositions(dict):
+  """
+  The start positions of each n-gram in a sentence, indexed by n.
+  The positions of each n are only calculated the first time they are needed.
+
+  Each n-gram is represented by an integer id: unigram ids are assigned to words, and the id of an n-gram is
+  assigned to the pair of the id of its first n-1 words and its last word. The ids are stored in `vocab`, which
+  should be shared between the sentences that are compared.
+  """
+  def __init__(self, sent, vocab):
+    self.vocab = vocab
+    self.ids = [[vocab.setdefault(word, len(vocab)) for word in sent]]
+
+  def gram_ids(self, n):
+    """
+    Get the ids of the n-grams starting at each position of the sentence.
+    """
+    ids, vocab = self.ids, self.vocab
+    while len(ids) < n:
+      ids.append([vocab.setdefault(key, len(vocab)) for key in zip(ids[-1], ids[0][len(ids):])])
+    return ids[n-1]
+
+  def __missing__(self, n):
+    gram_pos = self[n] = _count_ngram(self.gram_ids(n))
+    return gram_pos
+
 def ngram_context_align(ref, out, order=-1, case_insensitive=False):
   """
   Calculate the word alignment between a reference sentence and an output sentence. 
@@ -36,27 +59,37 @@ def ngram_context_align(ref, out, order=-1, case_insensitive=False):
 
   order = len(ref) if order == -1 else order
 
-  ref_gram_pos = _count_ngram(ref, order)
-  out_gram_pos = _count_ngram(out, order)
+  # Most words are aligned by their unigram or a short context, so n-grams are only counted for the lengths
+  # that actually get looked up
+  vocab = {}
+  ref_gram_pos = _NgramPositions(ref, vocab)
+  out_gram_pos = _NgramPositions(out, vocab)
+
+  # Words that occur exactly once in both sentences are aligned directly by their unigram. The other words get a
+  # position of -1 if they need their context to be aligned, or -2 if they are not in the reference at all
+  ref_ids = np.array(ref_gram_pos.gram_ids(1), dtype=int)
+  out_ids = np.array(out_gram_pos.gram_ids(1), dtype=int)
+  ref_counts = np.bincount(ref_ids, minlength=len(vocab))[out_ids]
+  out_counts = np.bincount(out_ids, minlength=len(vocab))[out_ids]
+  ref_pos_of = np.full(len(vocab), -1)
+  ref_pos_of[ref_ids] = np.arange(len(ref_ids))
+  uniq_pos = np.where((ref_counts == 1) & (out_counts == 1), ref_pos_of[out_ids], -1)
+  uniq_pos[ref_counts == 0] = -2
 
   worder = []
-  for i, word in enumerate(out):
-    if len(ref_gram_pos[1][word]) == 0:
-      continue
-    if len(ref_gram_pos[1][word]) == len(out_gram_pos[1][word]) == 1:
-      worder.append(ref_gram_pos[1][word][0])
-    else:
-      word_forward = word 
-      word_backward = word 
+  for i, ref_pos in enumerate(uniq_pos.tolist()):
+    if ref_pos >= 0:
+      worder.append(ref_pos)
+    elif ref_pos == -1:
       for j in range(1, order):
         if i - j >= 0:
-          word_backward = out[i-j] + ' ' + word_backward 
+          word_backward = out_gram_pos.gram_ids(j+1)[i-j]
           if len(ref_gram_pos[j+1][word_backward]) == len(out_gram_pos[j+1][word_backward]) == 1:
             worder.append(ref_gram_pos[j+1][word_backward][0]+j)
             break
 
         if i + j < len(out):
-          word_forward = word_forward + ' ' + out[i+j]
+          word_forward = out_gram_pos.gram_ids(j+1)[i]
           if len(ref_gram_pos[j+1][word_forward]) == len(out_gram_pos[j+1][word_forward]) == 1:
             worder.append(ref_gram_pos[j+1][word_forward][0])
             break
@@ -1,24 +1,26 @@
+import functools
+
 def parse_profile(profile):
-  kargs = {}
-  try:
-    for kv in profile.split(','):
-      k, v = kv.split('=')
-      kargs[k] = v
-  except ValueError:
-    # more informative error message
-    raise ValueError(
-      f"Failed to parse profile: {profile}. The expected format is:"
-      " \"key1=value1,key2=value2,[...]\""
-    )
-  return kargs
+  return dict(_parse_profile_items(profile))
+
+@functools.lru_cache(maxsize=128)
+def _parse_profile_items(profile):
+  # Profiles are parsed into an immutable tuple so the cached result can't be modified by callers
+  kargs = []
+  for kv in profile.split(','):
+    k, sep, v = kv.partition('=')
+    if not sep:
+      # more informative error message
+      raise ValueError(
+        f"Failed to parse profile: {profile}. The expected format is:"
+        " \"key1=value1,key2=value2,[...]\""
+      )
+    kargs.append((k, v))
+  return tuple(kargs)
 
 def parse_compare_directions(compare_directions):
-  direcs = []
   try:
-    for direc in compare_directions.split(';'):
-      left, right = direc.split('-')
-      left, right = int(left), int(right)
-      direcs.append((left, right))
+    direcs = [(int(left), int(right)) for left, right in (direc.split('-') for direc in compare_directions.split(';'))]
   except ValueError:
     # more informative error message
     raise ValueError(
@@ -28,12 +30,12 @@ def parse_compare_directions(compare_directions):
   return direcs
 
 def parse_files(filenames):
-  files = []
-  for f in filenames.split(';'):
-    files.append(f)
-  return files
+  return filenames.split(';')
 
 def parse_intfloat(s):
+  # Strings with a decimal point or an exponent can't be ints, so don't try (and fail) to parse them as one
+  if '.' in s or 'e' in s or 'E' in s:
+    return float(s)
   try:
     return int(s)
   except ValueError:
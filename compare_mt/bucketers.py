@@ -1,7 +1,10 @@
+import io
+import re
 import sys
+import bisect
 import itertools
 import numpy as np
-from collections import defaultdict
+from collections import Counter
 
 from compare_mt import corpus_utils
 from compare_mt import scorers
@@ -9,8 +12,11 @@ from compare_mt import arg_utils
 
 class Bucketer:
 
+  __slots__ = ('bucket_cutoffs', '_cutoffs_tuple', 'bucket_strs')
+
   def set_bucket_cutoffs(self, bucket_cutoffs, num_type='int'):
     self.bucket_cutoffs = bucket_cutoffs
+    self._cutoffs_tuple = tuple(bucket_cutoffs)
     self.bucket_strs = []
     for i, x in enumerate(bucket_cutoffs):
       if i == 0:
@@ -22,13 +28,29 @@ class Bucketer:
     self.bucket_strs.append(f'>={x}')
 
   def cutoff_into_bucket(self, value):
-    for i, v in enumerate(self.bucket_cutoffs):
-      if value < v:
-        return i
-    return len(self.bucket_cutoffs)
+    # The bucket is the index of the first cutoff greater than value, i.e. the number of
+    # cutoffs less than or equal to it
+    return bisect.bisect_right(self._cutoffs_tuple, value)
+
+  def cutoff_into_buckets(self, values):
+    """
+    Calculate the buckets of many values at once, equivalent to calling cutoff_into_bucket on each of them
+
+    Args:
+      values: A sequence or array of values
+
+    Returns:
+      An array of integer bucket IDs
+    """
+    return np.searchsorted(np.asarray(self.bucket_cutoffs), values, side='right')
 
 class WordBucketer(Bucketer):
 
+  __slots__ = ('case_insensitive',)
+
+  # Whether calc_bucket returns a tuple of buckets for each word instead of a single bucket
+  multiple_buckets = False
+
   def calc_bucket(self, val, label=None):
     """
     Calculate the bucket for a particular word
@@ -43,95 +65,92 @@ class WordBucketer(Bucketer):
     raise NotImplementedError('calc_bucket must be implemented in subclasses of WordBucketer')
 
   def _calc_trg_matches(self, ref_sent, out_sents):
-    ref_pos = defaultdict(lambda: [])
-    out_matches = [[-1 for _ in s] for s in out_sents]
-    ref_matches = [[-1 for _ in ref_sent] for _ in out_sents]
+    ref_pos = {}
+    out_matches = [[-1] * len(s) for s in out_sents]
+    ref_matches = [[-1] * len(ref_sent) for _ in out_sents]
     for ri, ref_word in enumerate(ref_sent):
-      ref_pos[ref_word].append(ri)
-    for oai, out_sent in enumerate(out_sents):
+      ref_pos.setdefault(ref_word, []).append(ri)
+    for out_sent, out_match, ref_match in zip(out_sents, out_matches, ref_matches):
       out_word_cnts = {}
       for oi, out_word in enumerate(out_sent):
         ref_poss = ref_pos.get(out_word, None)
         if ref_poss:
           out_word_cnt = out_word_cnts.get(out_word, 0)
           if out_word_cnt < len(ref_poss):
-            out_matches[oai][oi] = ref_poss[out_word_cnt]
-            ref_matches[oai][ref_poss[out_word_cnt]] = oi
+            ri = ref_poss[out_word_cnt]
+            out_match[oi] = ri
+            ref_match[ri] = oi
           out_word_cnts[out_word] = out_word_cnt + 1
     return out_matches, ref_matches
 
   def _calc_trg_buckets_and_matches(self, ref_sent, ref_label, out_sents, out_labels):
     # Initial setup for special cases
     if self.case_insensitive:
-      ref_sent = [corpus_utils.lower(w) for w in ref_sent]
-      out_sents = [[corpus_utils.lower(w) for w in out_sent] for out_sent in out_sents]
-    if not ref_label:
-      ref_label = []
-      out_labels = [[] for _ in out_sents]
+      ref_sent = corpus_utils.lower(ref_sent)
+      out_sents = corpus_utils.lower(out_sents)
     # Get matches
     out_matches, _ = self._calc_trg_matches(ref_sent, out_sents)
-    # Process the reference, getting the bucket
-    ref_buckets = [self.calc_bucket(w, label=l) for (w,l) in itertools.zip_longest(ref_sent, ref_label)]
-    # Process each of the outputs, finding matches
-    out_buckets = [[] for _ in out_sents]
-    for oai, (out_sent, out_label, match, out_buck) in \
-            enumerate(itertools.zip_longest(out_sents, out_labels, out_matches, out_buckets)):
-      for oi, (w, l, m) in enumerate(itertools.zip_longest(out_sent, out_label, match)):
-        out_buck.append(self.calc_bucket(w, label=l) if m < 0 else ref_buckets[m])
+    calc_bucket = self.calc_bucket
+    if ref_label:
+      # Process the reference, getting the bucket
+      ref_buckets = [calc_bucket(w, label=l) for (w,l) in itertools.zip_longest(ref_sent, ref_label)]
+      # Process each of the outputs, finding matches
+      out_buckets = [[] for _ in out_sents]
+      for oai, (out_sent, out_label, match, out_buck) in \
+              enumerate(itertools.zip_longest(out_sents, out_labels, out_matches, out_buckets)):
+        for oi, (w, l, m) in enumerate(itertools.zip_longest(out_sent, out_label, match)):
+          out_buck.append(calc_bucket(w, label=l) if m < 0 else ref_buckets[m])
+    else:
+      # Same as above, for the common case of unlabeled words
+      ref_buckets = [calc_bucket(w) for w in ref_sent]
+      out_buckets = [[calc_bucket(w) if m < 0 else ref_buckets[m] for (w, m) in zip(out_sent, match)]
+                     for out_sent, match in zip(out_sents, out_matches)]
     # Calculate totals for each sentence
     num_buckets = len(self.bucket_strs)
     num_outs = len(out_sents)
-    my_ref_total = np.zeros(num_buckets ,dtype=int)
+    my_ref_total = self._count_buckets(ref_buckets, num_buckets)
     my_out_totals = np.zeros( (num_outs, num_buckets) ,dtype=int)
     my_out_matches = np.zeros( (num_outs, num_buckets) ,dtype=int)
-    for b in ref_buckets:
-      if isinstance(b, list):
-        for bi in b:
-          my_ref_total[bi] += 1
-      else:
-        my_ref_total[b] += 1
     for oi, (obs, ms) in enumerate(zip(out_buckets, out_matches)):
-      for b, m in zip(obs, ms):
-        if isinstance(b, list):
-          for bi in b:
-            my_out_totals[oi,bi] += 1
-            if m >= 0:
-              my_out_matches[oi,bi] += 1
-        else:
-          my_out_totals[oi,b] += 1
-          if m >= 0:
-            my_out_matches[oi,b] += 1
+      my_out_totals[oi] = self._count_buckets(obs, num_buckets)
+      my_out_matches[oi] = self._count_buckets([b for b, m in zip(obs, ms) if m >= 0], num_buckets)
     return my_ref_total, my_out_totals, my_out_matches, ref_buckets, out_buckets, out_matches
 
+  def _count_buckets(self, buckets, num_buckets):
+    if self.multiple_buckets:
+      # Words with several labels are counted once in each of their buckets
+      buckets = list(itertools.chain.from_iterable(buckets))
+    return np.bincount(np.asarray(buckets, dtype=int), minlength=num_buckets)
+
   def _calc_src_buckets_and_matches(self, src_sent, src_label, ref_sent, ref_aligns, out_sents):
     # Initial setup for special cases
     if self.case_insensitive:
-      src_sent = [corpus_utils.lower(w) for w in src_sent]
-      ref_sent = [corpus_utils.lower(w) for w in ref_sent]
-      out_sents = [[corpus_utils.lower(w) for w in out_sent] for out_sent in out_sents]
-    if not src_label:
-      src_label = []
+      src_sent = corpus_utils.lower(src_sent)
+      ref_sent = corpus_utils.lower(ref_sent)
+      out_sents = corpus_utils.lower(out_sents)
     # Get matches
     _, ref_matches = self._calc_trg_matches(ref_sent, out_sents)
     # Process the source, getting the bucket
-    src_buckets = [self.calc_bucket(w, label=l) for (w,l) in itertools.zip_longest(src_sent, src_label)]
+    if src_label:
+      src_buckets = [self.calc_bucket(w, label=l) for (w,l) in itertools.zip_longest(src_sent, src_label)]
+    else:
+      src_buckets = [self.calc_bucket(w) for w in src_sent]
     # For each source word, find the reference words that need to be correct
     src_aligns = [[] for _ in src_sent]
     for src, trg in ref_aligns:
       src_aligns[src].append(trg)
-    # Calculate totals for each sentence
+    # Calculate totals for each sentence, from a matrix with a one for the bucket(s) of each source word
     num_buckets = len(self.bucket_strs)
     num_outs = len(out_sents)
-    my_ref_total = np.zeros(num_buckets ,dtype=int)
-    my_out_matches = np.zeros( (num_outs, num_buckets) ,dtype=int)
-    for src_bucket in src_buckets:
-      my_ref_total[src_bucket] += 1
+    src_bucket_mat = np.zeros( (len(src_buckets), num_buckets) ,dtype=int)
+    for si, src_bucket in enumerate(src_buckets):
+      src_bucket_mat[si, src_bucket] = 1
+    my_ref_total = src_bucket_mat.sum(axis=0)
     my_out_totals = np.broadcast_to(np.reshape(my_ref_total, (1, num_buckets)), (num_outs, num_buckets))
-    for oai, (out_sent, ref_match) in enumerate(zip(out_sents, ref_matches)):
-      for src_bucket, src_align in zip(src_buckets, src_aligns):
-        if len(src_align) != 0:
-          if all([ref_match[x] >= 0 for x in src_align]):
-            my_out_matches[oai,src_bucket] += 1
+    # A source word is matched if all of the reference words that it is aligned to are matched
+    src_matched = np.array([[len(src_align) != 0 and all([ref_match[x] >= 0 for x in src_align])
+                             for src_align in src_aligns] for ref_match in ref_matches], dtype=int)
+    my_out_matches = np.reshape(src_matched, (num_outs, len(src_buckets))) @ src_bucket_mat
     return my_ref_total, my_out_totals, my_out_matches, src_buckets, src_aligns, ref_matches
 
   def calc_statistics(self, ref, outs,
@@ -159,8 +178,9 @@ class WordBucketer(Bucketer):
         rec: recall of the bucket
         prec: precision of the bucket
         fmeas: f1-measure of the bucket
-      my_ref_total_list: containing a list of statistics of the reference
-      my_out_matches_list: containing a list of statistics of the outputs
+      my_ref_total_list: containing an array of statistics of the reference, one row per sentence
+      my_out_totals_list: containing an array of the totals of the outputs, one row per sentence
+      my_out_matches_list: containing an array of statistics of the outputs, one row per sentence
     """
     if not hasattr(self, 'case_insensitive'):
       self.case_insensitive = False
@@ -169,14 +189,11 @@ class WordBucketer(Bucketer):
     num_buckets = len(self.bucket_strs)
     num_outs = len(outs)
 
-    # Initialize the sufficient statistics for prec/rec/fmeas
-    ref_total = np.zeros(num_buckets, dtype=int)
-    out_totals = np.zeros( (num_outs, num_buckets) ,dtype=int)
-    out_matches = np.zeros( ( num_outs, num_buckets) ,dtype=int)
-
-    my_ref_total_list = []
-    my_out_totals_list = []
-    my_out_matches_list = []
+    # Initialize the sufficient statistics of each sentence for prec/rec/fmeas
+    num_sents = len(ref)
+    my_ref_total_list = np.zeros( (num_sents, num_buckets) ,dtype=int)
+    my_out_totals_list = np.zeros( (num_sents, num_outs, num_buckets) ,dtype=int)
+    my_out_matches_list = np.zeros( (num_sents, num_outs, num_buckets) ,dtype=int)
 
     # Step through the sentences
     for rsi, (ref_sent, ref_label) in enumerate(itertools.zip_longest(ref, ref_labels if ref_labels else [])):
@@ -193,15 +210,14 @@ class WordBucketer(Bucketer):
                                               ref_label,
                                               [x[rsi] for x in outs],
                                               [x[rsi] for x in out_labels] if out_labels else None)
-      ref_total += my_ref_total
-      out_totals += my_out_totals
-      out_matches += my_out_matches
-
-      my_ref_total_list.append(my_ref_total)
-      my_out_totals_list.append(my_out_totals)
-      my_out_matches_list.append(my_out_matches)
+      my_ref_total_list[rsi] = my_ref_total
+      my_out_totals_list[rsi] = my_out_totals
+      my_out_matches_list[rsi] = my_out_matches
 
     # Calculate statistics
+    ref_total = my_ref_total_list.sum(axis=0)
+    out_totals = my_out_totals_list.sum(axis=0)
+    out_matches = my_out_matches_list.sum(axis=0)
     statistics = [[] for _ in range(num_outs)]
     for oi, ostatistics in enumerate(statistics):
       for bi in range(num_buckets):
@@ -222,42 +238,48 @@ class WordBucketer(Bucketer):
 
     num_outs, num_buckets = my_out_totals_list[0].shape
     n = len(my_ref_total_list)
-    ids = list(range(n))
     sample_size = int(np.ceil(n*sample_ratio))
     rt_arr = np.array(my_ref_total_list)
-    ot_arr = np.array(my_out_totals_list)
-    om_arr = np.array(my_out_matches_list)
-    statistics = [[ [] for __ in range(num_buckets) ] for _ in range(num_outs)]
-    for _ in range(num_samples):
-      reduced_ids = np.random.choice(ids, size=sample_size, replace=True)
-      reduced_ref_total, reduced_out_totals, reduced_out_matches= rt_arr[reduced_ids].sum(0), ot_arr[reduced_ids].sum(0), om_arr[reduced_ids].sum(0)
-      # Calculate accuracy on the reduced sample and save stats
-      for oi in range(num_outs):
-        for bi in range(num_buckets):
-          mcnt, ocnt, rcnt = reduced_out_matches[oi,bi], reduced_out_totals[oi,bi], reduced_ref_total[bi]
-          if mcnt == 0:
-            rec, prec, fmeas = 0.0, 0.0, 0.0
-          else:
-            rec = mcnt / float(rcnt)
-            prec = mcnt / float(ocnt)
-            fmeas = 2 * prec * rec / (prec + rec)
-          statistics[oi][bi].append( (mcnt, rcnt, ocnt, rec, prec, fmeas) )
-
+    ot_arr = np.array(my_out_totals_list).reshape(n, num_outs*num_buckets)
+    om_arr = np.array(my_out_matches_list).reshape(n, num_outs*num_buckets)
+    # Draw the samples in blocks, and count how many times each sentence is in each sample of the block, so the sums
+    # over the sentences of the samples are a single matrix product. Blocks keep the counts to a few million entries.
+    reduced_ref_total = np.zeros( (num_samples, num_buckets) ,dtype=rt_arr.dtype)
+    reduced_out_totals = np.zeros( (num_samples, num_outs*num_buckets) ,dtype=ot_arr.dtype)
+    reduced_out_matches = np.zeros( (num_samples, num_outs*num_buckets) ,dtype=om_arr.dtype)
+    block_size = max(1, 2**22 // max(n, 1))
+    for start in range(0, num_samples, block_size):
+      end = min(start + block_size, num_samples)
+      reduced_ids = np.random.choice(n, size=(end - start, sample_size), replace=True)
+      sample_offsets = np.arange(end - start).reshape(end - start, 1) * n
+      sample_counts = np.bincount((reduced_ids + sample_offsets).ravel(), minlength=(end - start)*n).reshape(end - start, n)
+      reduced_ref_total[start:end] = sample_counts @ rt_arr
+      reduced_out_totals[start:end] = sample_counts @ ot_arr
+      reduced_out_matches[start:end] = sample_counts @ om_arr
+    reduced_ref_total = reduced_ref_total.reshape(num_samples, 1, num_buckets)
+    reduced_out_totals = reduced_out_totals.reshape(num_samples, num_outs, num_buckets)
+    reduced_out_matches = reduced_out_matches.reshape(num_samples, num_outs, num_buckets)
+    # Calculate accuracy on the reduced samples
+    with np.errstate(divide='ignore', invalid='ignore'):
+      recs = reduced_out_matches / reduced_ref_total.astype(float)
+      precs = reduced_out_matches / reduced_out_totals.astype(float)
+      fmeas = 2 * precs * recs / (precs + recs)
+    matched = reduced_out_matches != 0
+    stats = [np.where(matched, x, 0.0) for x in (recs, precs, fmeas)]
+
+    # Get the lower and upper bounds of recall, precision and f-measure for every output and bucket
+    if num_samples > 0:
+      lower_idx, upper_idx = int(num_samples * 0.025), int(num_samples * 0.975)
+      bound_stats = [np.partition(x, [lower_idx, upper_idx], axis=0)[[lower_idx, upper_idx]].tolist() for x in stats]
+    else:
+      bound_stats = [np.zeros( (2, num_outs, num_buckets) ).tolist() for _ in stats]
     intervals = [[] for _ in range(num_outs)]
     for oi in range(num_outs):
       for bi in range(num_buckets):
-        if len(statistics[oi][bi]) > 0: 
-          _, _, _, recs, precs, fmeas = zip(*statistics[oi][bi])
-        else:
-          recs, precs, fmeas = [0.0], [0.0], [0.0]
         # The first three elements (intervals of mcnt, ocnt and rcnt) are None
         bounds = [None, None, None]
-        for x in [recs, precs, fmeas]:
-          x = list(x)
-          x.sort()
-          lower_bound = x[int(num_samples * 0.025)]
-          upper_bound = x[int(num_samples * 0.975)]
-          bounds.append( (lower_bound, upper_bound) )
+        for lower_bounds, upper_bounds in bound_stats:
+          bounds.append( (lower_bounds[oi][bi], upper_bounds[oi][bi]) )
         intervals[oi].append(bounds)
  
     return ref_total, intervals
@@ -290,16 +312,19 @@ class WordBucketer(Bucketer):
     num_examp_feats = 3
     example_scores = np.zeros( (num_sents, num_examp_feats, num_buckets) )
 
-    # Step through the sentences
-    for rsi, (my_ref_total, my_out_matches) in enumerate(zip(my_ref_total_list, my_out_matches_list)):
+    # Score all of the sentences at once
+    ref_totals = np.array(my_ref_total_list).reshape( (num_sents, 1, num_buckets) )
+    out_matches = np.array(my_out_matches_list).reshape( (num_sents, num_outs, num_buckets) )
+    total_out_matches = out_matches.sum(axis=1)
+    total_ref = ref_totals[:,0]*num_outs
 
-      # Scoring of examples across different dimensions:
-      #  0: overall variance of matches
-      example_scores[rsi,0] = (my_out_matches / (my_ref_total+1e-10).reshape( (1, num_buckets) )).std(axis=0)
-      #  1: overall percentage of matches
-      example_scores[rsi,1] = my_out_matches.sum(axis=0) / (my_ref_total*num_outs+1e-10)
-      #  2: overall percentage of misses
-      example_scores[rsi,2] = (my_ref_total*num_outs-my_out_matches.sum(axis=0)) / (my_ref_total*num_outs+1e-10)
+    # Scoring of examples across different dimensions:
+    #  0: overall variance of matches
+    example_scores[:,0] = (out_matches / (ref_totals+1e-10)).std(axis=1)
+    #  1: overall percentage of matches
+    example_scores[:,1] = total_out_matches / (total_ref+1e-10)
+    #  2: overall percentage of misses
+    example_scores[:,2] = (total_ref-total_out_matches) / (total_ref+1e-10)
 
     # Calculate statistics
     # Find top-5 examples of each class
@@ -342,31 +367,33 @@ class WordBucketer(Bucketer):
       self.case_insensitive = False
 
     src_labels = src_labels if src_labels else []
-    matches = [[0, 0, 0] for x in self.bucket_strs]
+    # Collect the bucket of every aligned word over the whole corpus, and count them at the end
+    both_buckets, ref_buckets, out_buckets = [], [], []
+    calc_bucket = self.calc_bucket
     for src_sent, ref_sent, out_sent, ref_align, out_align, src_lab in itertools.zip_longest(src, ref, out, ref_aligns, out_aligns, src_labels):
-      ref_cnt = defaultdict(lambda: 0)
-      for i, word in enumerate(ref_sent):
-        if self.case_insensitive:
-          word = corpus_utils.lower(word)
-        ref_cnt[word] += 1
+      if self.case_insensitive:
+        ref_sent = corpus_utils.lower(ref_sent)
+        out_sent = corpus_utils.lower(out_sent)
+      ref_cnt = Counter(ref_sent)
       for i, (src_index, trg_index) in enumerate(out_align):
         src_word = src_sent[src_index]
         word = out_sent[trg_index]
-        if self.case_insensitive:
-          word = corpus_utils.lower(word)
-        bucket = self.calc_bucket(src_word,
-                                  label=src_lab[src_index] if src_lab else None)
-        if ref_cnt[word] > 0:
+        bucket = calc_bucket(src_word,
+                             label=src_lab[src_index] if src_lab else None)
+        if ref_cnt.get(word, 0) > 0:
           ref_cnt[word] -= 1
-          matches[bucket][0] += 1
-        matches[bucket][2] += 1
+          both_buckets.append(bucket)
+        out_buckets.append(bucket)
       for i, (src_index, trg_index) in enumerate(ref_align):
         src_word = src_sent[src_index]
-        bucket = self.calc_bucket(src_word,
-                                  label=src_lab[src_index] if src_lab else None)
-        matches[bucket][1] += 1
+        ref_buckets.append(calc_bucket(src_word,
+                                       label=src_lab[src_index] if src_lab else None))
 
-    for both_tot, ref_tot, out_tot in matches:
+    num_buckets = len(self.bucket_strs)
+    matches = np.stack([np.bincount(np.asarray(b, dtype=int), minlength=num_buckets)
+                        for b in (both_buckets, ref_buckets, out_buckets)], axis=1)
+
+    for both_tot, ref_tot, out_tot in matches.tolist():
       if both_tot == 0:
         rec, prec, fmeas = 0.0, 0.0, 0.0
       else:
@@ -392,29 +419,37 @@ class WordBucketer(Bucketer):
 
     if type(corpus) == str:
       corpus = corpus_utils.load_tokens(corpus)
-    bucketed_likelihoods = [[0.0, 0] for _ in self.bucket_strs]
     if len(corpus) != len(likelihoods):
       raise ValueError("Corpus and likelihoods should have the same size.")
+    # Collect the bucket of every word over the whole corpus, and sum the likelihoods of each bucket at the end
+    buckets, all_likelihoods = [], []
+    calc_bucket = self.calc_bucket
     for sent, list_of_likelihoods in zip(corpus, likelihoods):
       if len(sent) != len(list_of_likelihoods):
         raise ValueError("Each sentence of the corpus should have likelihood value for each word")
+      if self.case_insensitive:
+        sent = corpus_utils.lower(sent)
+      buckets.extend([calc_bucket(word, label=word) for word in sent])
+      all_likelihoods.extend(list_of_likelihoods)
 
-      for word, ll in zip(sent, list_of_likelihoods):
-        if self.case_insensitive:
-          word = corpus_utils.lower(word)
-        bucket = self.calc_bucket(word, label=word)
-        bucketed_likelihoods[bucket][0] += ll
-        bucketed_likelihoods[bucket][1] += 1
-
-    for ll, count in bucketed_likelihoods:
+    num_buckets = len(self.bucket_strs)
+    buckets = np.asarray(buckets, dtype=int)
+    ll_sums = np.bincount(buckets, weights=np.asarray(all_likelihoods, dtype=float), minlength=num_buckets)
+    counts = np.bincount(buckets, minlength=num_buckets)
+    for ll, count in zip(ll_sums.tolist(), counts.tolist()):
       if count != 0:
         yield ll/float(count)
       else:
         yield "NA" # not applicable
 
 
+# A counts file where every line is a word without spaces, a tab and a count
+_freq_count_file_re = re.compile(r'(?:\S+\t\d+\n)*(?:\S+\t\d+)?')
+
 class FreqWordBucketer(WordBucketer):
 
+  __slots__ = ('freq_counts', '_bucket_cache')
+
   def __init__(self,
                freq_counts=None, freq_count_file=None, freq_corpus_file=None, freq_data=None,
                bucket_cutoffs=None,
@@ -436,45 +471,73 @@ class FreqWordBucketer(WordBucketer):
     """
     self.case_insensitive = case_insensitive
     if not freq_counts:
-      freq_counts = defaultdict(lambda: 0)
-      if freq_count_file != None:
-        print(f'Reading frequency from "{freq_count_file}"')
-        with open(freq_count_file, "r") as f:
-          for line in f:
-            cols = line.strip().split('\t')
-            if len(cols) != 2:
-              print(f'Bad line in counts file {freq_count_file}, ignoring:\n{line}')
-            else:
-              word, freq = cols
-              if self.case_insensitive:
-                word = corpus_utils.lower(word)
-              freq_counts[word] = int(freq)
-      elif freq_corpus_file:
-        print(f'Reading frequency from "{freq_corpus_file}"')
-        for words in corpus_utils.iterate_tokens(freq_corpus_file):
-          for word in words:
-            if self.case_insensitive:
-              word = corpus_utils.lower(word)
-            freq_counts[word] += 1
-      elif freq_data:
-        print('Reading frequency from the reference')
-        for words in freq_data:
-          for word in words:
-            if self.case_insensitive:
-              word = corpus_utils.lower(word)
-            freq_counts[word] += 1
-      else:
-        raise ValueError('Must have at least one source of frequency counts for FreqWordBucketer')
+      freq_counts = self._load_freq_counts(freq_count_file, freq_corpus_file, freq_data)
     self.freq_counts = freq_counts
 
     if bucket_cutoffs is None:
       bucket_cutoffs = [1, 2, 3, 4, 5, 10, 100, 1000]
     self.set_bucket_cutoffs(bucket_cutoffs)
 
-  def calc_bucket(self, word, label=None):
+    # Bucket the whole counted vocabulary in one vectorized call; calc_bucket fills in other words lazily.
+    # The cache is keyed by the words as they are passed to calc_bucket, before lower-casing, so words that
+    # were already lower-cased by the caller aren't lower-cased again. Counts of words that aren't lower-case
+    # can't be looked up in case insensitive mode, so they are left out.
+    words = list(freq_counts.keys())
+    freqs = np.fromiter(freq_counts.values(), dtype=float, count=len(freq_counts))
+    buckets = self.cutoff_into_buckets(freqs)
+    self._bucket_cache = dict(zip(words, buckets.tolist()))
+    if case_insensitive:
+      for word in words:
+        if word.lower() != word:
+          del self._bucket_cache[word]
+
+  def _load_freq_counts(self, freq_count_file, freq_corpus_file, freq_data):
+    freq_counts = Counter()
+    if freq_count_file != None:
+      print(f'Reading frequency from "{freq_count_file}"')
+      with open(freq_count_file, "r") as f:
+        text = f.read()
+      if _freq_count_file_re.fullmatch(text):
+        # Well-formed files (like the ones written by scripts/count.py) are read in one go
+        cols = text.split()
+        words = corpus_utils.lower(cols[0::2]) if self.case_insensitive else cols[0::2]
+        freq_counts.update(dict(zip(words, map(int, cols[1::2]))))
+      else:
+        for line in io.StringIO(text):
+          cols = line.strip().split('\t')
+          if len(cols) != 2:
+            print(f'Bad line in counts file {freq_count_file}, ignoring:\n{line}')
+          else:
+            word, freq = cols
+            if self.case_insensitive:
+              word = corpus_utils.lower(word)
+            freq_counts[word] = int(freq)
+    elif freq_corpus_file:
+      print(f'Reading frequency from "{freq_corpus_file}"')
+      freq_counts = self._count_words(corpus_utils.iterate_tokens(freq_corpus_file))
+    elif freq_data:
+      print('Reading frequency from the reference')
+      freq_counts = self._count_words(freq_data)
+    else:
+      raise ValueError('Must have at least one source of frequency counts for FreqWordBucketer')
+    return freq_counts
+
+  def _count_words(self, corpus):
+    words = itertools.chain.from_iterable(corpus)
     if self.case_insensitive:
-      word = corpus_utils.lower(word)
-    return self.cutoff_into_bucket(self.freq_counts.get(word, 0))
+      # Tokens are strings, so lower-case them with str.lower directly rather than through corpus_utils.lower
+      words = map(str.lower, words)
+    return Counter(words)
+
+  def calc_bucket(self, word, label=None):
+    bucket = self._bucket_cache.get(word)
+    if bucket is None:
+      lower_word = corpus_utils.lower(word) if self.case_insensitive else word
+      bucket = self._bucket_cache.get(lower_word)
+      if bucket is None:
+        bucket = self._bucket_cache[lower_word] = self.cutoff_into_bucket(self.freq_counts.get(lower_word, 0))
+      self._bucket_cache[word] = bucket
+    return bucket
 
   def name(self):
     return "frequency"
@@ -484,6 +547,8 @@ class FreqWordBucketer(WordBucketer):
 
 class CaseWordBucketer(WordBucketer):
 
+  __slots__ = ()
+
   def __init__(self):
     """
     A bucketer that buckets words by whether they're all all lower-case (lower), all upper-case (upper),
@@ -509,6 +574,8 @@ class CaseWordBucketer(WordBucketer):
 
 class LabelWordBucketer(WordBucketer):
 
+  __slots__ = ('bucket_map',)
+
   def __init__(self,
                label_set=None):
     """
@@ -520,15 +587,12 @@ class LabelWordBucketer(WordBucketer):
     if type(label_set) == str:
       label_set = label_set.split('+')
     self.bucket_strs = label_set + ['other']
-    label_set_len = len(label_set)
-    self.bucket_map = defaultdict(lambda: label_set_len)
-    for i, l in enumerate(label_set):
-      self.bucket_map[l] = i
+    self.bucket_map = {l: i for i, l in enumerate(label_set)}
 
   def calc_bucket(self, word, label=None):
     if not label:
       raise ValueError('When calculating buckets by label, label must be non-zero')
-    return self.bucket_map[label]
+    return self.bucket_map.get(label, len(self.bucket_strs)-1)
 
   def name(self):
     return "labels"
@@ -538,6 +602,10 @@ class LabelWordBucketer(WordBucketer):
 
 class MultiLabelWordBucketer(WordBucketer):
 
+  __slots__ = ('bucket_map', '_label_cache')
+
+  multiple_buckets = True
+
   def __init__(self,
                label_set=None):
     """
@@ -549,16 +617,17 @@ class MultiLabelWordBucketer(WordBucketer):
     if type(label_set) == str:
       label_set = label_set.split('+')
     self.bucket_strs = label_set + ['other']
-    label_set_len = len(label_set)
-    self.bucket_map = defaultdict(lambda: label_set_len)
-    for i, l in enumerate(label_set):
-      self.bucket_map[l] = i
+    self.bucket_map = {l: i for i, l in enumerate(label_set)}
+    # The buckets of each distinct label string
+    self._label_cache = {}
 
   def calc_bucket(self, word, label=None):
-    if not label:
-      raise ValueError('When calculating buckets by label, label must be non-zero')
-    label = label.split('+')
-    return [self.bucket_map[l] for l in label]
+    buckets = self._label_cache.get(label)
+    if buckets is None:
+      if not label:
+        raise ValueError('When calculating buckets by label, label must be non-zero')
+      buckets = self._label_cache[label] = tuple(self.bucket_map.get(l, len(self.bucket_strs)-1) for l in label.split('+'))
+    return buckets
 
   def name(self):
     return "multilabels"
@@ -568,6 +637,8 @@ class MultiLabelWordBucketer(WordBucketer):
 
 class NumericalLabelWordBucketer(WordBucketer):
 
+  __slots__ = ('_bucket_cache',)
+
   def __init__(self,
                bucket_cutoffs=None):
     """
@@ -582,12 +653,16 @@ class NumericalLabelWordBucketer(WordBucketer):
     if bucket_cutoffs is None:
       bucket_cutoffs = [0.25, 0.5, 0.75]
     self.set_bucket_cutoffs(bucket_cutoffs)
+    # Labels take few distinct values, so remember the bucket of each label string
+    self._bucket_cache = {}
 
   def calc_bucket(self, word, label=None):
-    if label:
-      return self.cutoff_into_bucket(float(label))
-    else:
-      raise ValueError('When calculating buckets by label must be non-zero')
+    bucket = self._bucket_cache.get(label)
+    if bucket is None:
+      if not label:
+        raise ValueError('When calculating buckets by label must be non-zero')
+      bucket = self._bucket_cache[label] = self.cutoff_into_bucket(float(label))
+    return bucket
 
   def name(self):
     return "numerical labels"
@@ -597,6 +672,8 @@ class NumericalLabelWordBucketer(WordBucketer):
 
 class SentenceBucketer(Bucketer):
 
+  __slots__ = ()
+
   def calc_bucket(self, val, ref=None, src=None, out_label=None, ref_label=None):
     """
     Calculate the bucket for a particular sentence
@@ -613,8 +690,37 @@ class SentenceBucketer(Bucketer):
     """
     raise NotImplementedError('calc_bucket must be implemented in subclasses of SentenceBucketer')
 
-  def create_bucketed_corpus(self, out, ref=None, src=None, ref_labels=None, out_labels=None):
-    bucketed_corpus = [([],[] if ref else None, []) for _ in self.bucket_strs]
+  def calc_buckets_batch(self, vals, refs, srcs, labels=None):
+    """
+    Calculate the buckets for a whole corpus at once.
+    Subclasses can override this to bucket all sentences in one vectorized step.
+
+    Args:
+      vals: The sentences to calculate the buckets for
+      refs: The reference sentences
+      srcs: The source sentences, or a None for each sentence
+      labels: The label of each sentence, if they exist
+
+    Returns:
+      A sequence of integer bucket IDs, one per sentence
+    """
+    labels = [None for _ in vals] if labels is None else labels
+    return [self.calc_bucket(val, ref, src, label=label) for val, ref, src, label in zip(vals, refs, srcs, labels)]
+
+  def calc_corpus_buckets(self, out, ref=None, src=None, ref_labels=None, out_labels=None):
+    """
+    Calculate the bucket of every sentence in a corpus
+
+    Args:
+      out: The output corpus
+      ref: The reference corpus, if it exists
+      src: The source corpus, if it exists
+      ref_labels: The labels of the reference sentences, if they exist
+      out_labels: The labels of the output sentences, if they exist
+
+    Returns:
+      A sequence of integer bucket IDs, one per sentence
+    """
     if ref is None:
       ref = out
 
@@ -623,9 +729,36 @@ class SentenceBucketer(Bucketer):
 
     src = [None for _ in out] if src is None else src
 
-    for i, (out_words, ref_words, src_words) in enumerate(zip(out, ref, src)):
-      bucket = self.calc_bucket(out_words, ref_words, src_words, label=(ref_labels[i][0] if ref_labels else None))
+    labels = [l[0] for l in ref_labels] if ref_labels else None
+
+    return self.calc_buckets_batch(out, ref, src, labels)
+
+  def calc_bucket_counts(self, out, ref=None, src=None, ref_labels=None, out_labels=None):
+    """
+    Count the sentences in each bucket without building the bucketed corpus
+
+    Args:
+      out: The output corpus
+      ref: The reference corpus, if it exists
+      src: The source corpus, if it exists
+      ref_labels: The labels of the reference sentences, if they exist
+      out_labels: The labels of the output sentences, if they exist
 
+    Returns:
+      A list with the number of sentences in each bucket
+    """
+    buckets = np.asarray(self.calc_corpus_buckets(out, ref, src, ref_labels, out_labels), dtype=int)
+    return np.bincount(buckets, minlength=len(self.bucket_strs)).tolist()
+
+  def create_bucketed_corpus(self, out, ref=None, src=None, ref_labels=None, out_labels=None):
+    bucketed_corpus = [([],[] if ref else None, []) for _ in self.bucket_strs]
+    buckets = self.calc_corpus_buckets(out, ref, src, ref_labels, out_labels)
+    if ref is None:
+      ref = out
+
+    src = [None for _ in out] if src is None else src
+
+    for bucket, out_words, ref_words, src_words in zip(buckets, out, ref, src):
       bucketed_corpus[bucket][0].append(out_words)
       bucketed_corpus[bucket][1].append(ref_words)
       bucketed_corpus[bucket][2].append(src_words)
@@ -638,6 +771,8 @@ class ScoreSentenceBucketer(SentenceBucketer):
   Bucket sentences by some score (e.g. BLEU)
   """
 
+  __slots__ = ('score_type', 'scorer', 'case_insensitive')
+
   def __init__(self, score_type, bucket_cutoffs=None, case_insensitive=False):
     self.score_type = score_type
     self.scorer = scorers.create_scorer_from_profile(score_type)
@@ -646,11 +781,18 @@ class ScoreSentenceBucketer(SentenceBucketer):
     self.set_bucket_cutoffs(bucket_cutoffs, num_type='float')
     self.case_insensitive = case_insensitive
 
-  def calc_bucket(self, val, ref=None, src=None, label=None):
+  def _score_sentence(self, val, ref, src):
     if self.case_insensitive:
-      return self.cutoff_into_bucket(self.scorer.score_sentence(corpus_utils.lower(ref), corpus_utils.lower(val))[0])
+      return self.scorer.score_sentence(corpus_utils.lower(ref), corpus_utils.lower(val))[0]
     else:
-      return self.cutoff_into_bucket(self.scorer.score_sentence(ref, val, src)[0])
+      return self.scorer.score_sentence(ref, val, src)[0]
+
+  def calc_bucket(self, val, ref=None, src=None, label=None):
+    return self.cutoff_into_bucket(self._score_sentence(val, ref, src))
+
+  def calc_buckets_batch(self, vals, refs, srcs, labels=None):
+    scores = [self._score_sentence(val, ref, src) for val, ref, src in zip(vals, refs, srcs)]
+    return self.cutoff_into_buckets(np.asarray(scores, dtype=float))
 
   def name(self):
     return self.scorer.name()
@@ -663,6 +805,8 @@ class LengthSentenceBucketer(SentenceBucketer):
   Bucket sentences by length
   """
 
+  __slots__ = ()
+
   def __init__(self, bucket_cutoffs=None):
     if bucket_cutoffs is None:
       bucket_cutoffs = [10, 20, 30, 40, 50, 60]
@@ -671,6 +815,10 @@ class LengthSentenceBucketer(SentenceBucketer):
   def calc_bucket(self, val, ref=None, src=None, label=None):
     return self.cutoff_into_bucket(len(ref))
 
+  def calc_buckets_batch(self, vals, refs, srcs, labels=None):
+    lens = np.fromiter((len(s) for s in refs), dtype=np.int32, count=len(refs))
+    return self.cutoff_into_buckets(lens)
+
   def name(self):
     return "length"
 
@@ -682,6 +830,8 @@ class LengthDiffSentenceBucketer(SentenceBucketer):
   Bucket sentences by length
   """
 
+  __slots__ = ()
+
   def __init__(self, bucket_cutoffs=None):
     if bucket_cutoffs is None:
       bucket_cutoffs = [-20, -10, -5, -4, -3, -2, -1, 0, 1, 2, 3, 4, 5, 6, 11, 21]
@@ -690,6 +840,10 @@ class LengthDiffSentenceBucketer(SentenceBucketer):
   def calc_bucket(self, val, ref=None, src=None, label=None):
     return self.cutoff_into_bucket(len(val) - len(ref))
 
+  def calc_buckets_batch(self, vals, refs, srcs, labels=None):
+    diffs = np.fromiter((len(v) - len(r) for v, r in zip(vals, refs)), dtype=np.int32, count=len(vals))
+    return self.cutoff_into_buckets(diffs)
+
   def name(self):
     return "len(output)-len(reference)"
 
@@ -698,6 +852,8 @@ class LengthDiffSentenceBucketer(SentenceBucketer):
 
 class LabelSentenceBucketer(SentenceBucketer):
 
+  __slots__ = ('bucket_map',)
+
   def __init__(self, label_set=None):
     """
     A bucketer that buckets sentences by their labels.
@@ -708,13 +864,10 @@ class LabelSentenceBucketer(SentenceBucketer):
     if type(label_set) == str:
       label_set = label_set.split('+')
     self.bucket_strs = label_set + ['other']
-    label_set_len = len(label_set)
-    self.bucket_map = defaultdict(lambda: label_set_len)
-    for i, l in enumerate(label_set):
-      self.bucket_map[l] = i
+    self.bucket_map = {l: i for i, l in enumerate(label_set)}
 
   def calc_bucket(self, val, ref=None, src=None, label=None):
-    return self.bucket_map[label]
+    return self.bucket_map.get(label, len(self.bucket_strs)-1)
 
   def name(self):
     return "labels"
@@ -724,6 +877,8 @@ class LabelSentenceBucketer(SentenceBucketer):
 
 class MultiLabelSentenceBucketer(SentenceBucketer):
 
+  __slots__ = ('bucket_map',)
+
   def __init__(self, label_set=None):
     """
     A bucketer that buckets sentences by their labels.
@@ -734,14 +889,11 @@ class MultiLabelSentenceBucketer(SentenceBucketer):
     if type(label_set) == str:
       label_set = label_set.split('+')
     self.bucket_strs = label_set + ['other']
-    label_set_len = len(label_set)
-    self.bucket_map = defaultdict(lambda: label_set_len)
-    for i, l in enumerate(label_set):
-      self.bucket_map[l] = i
+    self.bucket_map = {l: i for i, l in enumerate(label_set)}
 
   def calc_bucket(self, val, ref=None, src=None, label=None):
     label = label.split('+')
-    return [self.bucket_map[l] for l in label]
+    return [self.bucket_map.get(l, len(self.bucket_strs)-1) for l in label]
 
   def name(self):
     return "multilabels"
@@ -751,6 +903,8 @@ class MultiLabelSentenceBucketer(SentenceBucketer):
 
 class NumericalLabelSentenceBucketer(SentenceBucketer):
 
+  __slots__ = ()
+
   def __init__(self, bucket_cutoffs=None):
     """
     A bucketer that buckets sentences by labels that are numerical values.
@@ -768,6 +922,10 @@ class NumericalLabelSentenceBucketer(SentenceBucketer):
   def calc_bucket(self, val, ref=None, src=None, label=None):
     return self.cutoff_into_bucket(float(label))
 
+  def calc_buckets_batch(self, vals, refs, srcs, labels=None):
+    values = np.fromiter((float(label) for label in labels), dtype=float, count=len(vals))
+    return self.cutoff_into_buckets(values)
+
   def name(self):
     return "numerical labels"
 
@@ -1,6 +1,8 @@
 # Overall imports
 import argparse
-import operator
+import concurrent.futures
+import contextlib
+import io
 import numpy as np
 import numpy.random as npr
 import tempfile
@@ -89,7 +91,7 @@ def generate_score_report(
 def generate_word_accuracy_report(ref, outs,
                           src=None,
                           acc_type='fmeas', bucket_type='freq', bucket_cutoffs=None,
-                          freq_count_file=None, freq_corpus_file=None,
+                          freq_count_file=None, freq_corpus_file=None, freq_counts=None,
                           label_set=None,
                           ref_labels=None, out_labels=None,
                           title=None,
@@ -112,6 +114,8 @@ def generate_word_accuracy_report(ref, outs,
                       to use the frequency in the training set, in which case you specify the path of the
                       training corpus.
     freq_count_file: An alternative to freq_corpus that uses a count file in "word\tfreq" format.
+    freq_counts: A dictionary of word counts to use instead of freq_count_file or freq_corpus_file,
+                 e.g. to share the counts between several reports.
     ref_labels: either a filename of a file full of reference labels, or a list of strings corresponding to `ref`.
     out_labels: output labels. must be specified if ref_labels is specified.
     title: A string specifying the caption of the printed table
@@ -142,6 +146,7 @@ def generate_word_accuracy_report(ref, outs,
                                                          bucket_cutoffs=bucket_cutoffs,
                                                          freq_count_file=freq_count_file,
                                                          freq_corpus_file=freq_corpus_file,
+                                                         freq_counts=freq_counts,
                                                          freq_data=ref,
                                                          label_set=label_set,
                                                          case_insensitive=case_insensitive)
@@ -183,7 +188,7 @@ def generate_word_accuracy_report(ref, outs,
 
 def generate_src_word_accuracy_report(ref, outs, src, ref_align_file=None,
                           acc_type='rec', bucket_type='freq', bucket_cutoffs=None,
-                          freq_count_file=None, freq_corpus_file=None,
+                          freq_count_file=None, freq_corpus_file=None, freq_counts=None,
                           label_set=None,
                           src_labels=None,
                           title=None,
@@ -207,6 +212,8 @@ def generate_src_word_accuracy_report(ref, outs, src, ref_align_file=None,
                       se the frequency in the training set, in which case you specify the path of the target side
                       he training corpus.
     freq_count_file: An alternative to freq_corpus that uses a count file in "word\tfreq" format.
+    freq_counts: A dictionary of word counts to use instead of freq_count_file or freq_corpus_file,
+                 e.g. to share the counts between several reports.
     src_labels: either a filename of a file full of source labels, or a list of strings corresponding to `ref`.
     title: A string specifying the caption of the printed table
     case_insensitive: A boolean specifying whether to turn on the case insensitive option
@@ -234,6 +241,7 @@ def generate_src_word_accuracy_report(ref, outs, src, ref_align_file=None,
                                                          bucket_cutoffs=bucket_cutoffs,
                                                          freq_count_file=freq_count_file,
                                                          freq_corpus_file=freq_corpus_file,
+                                                         freq_counts=freq_counts,
                                                          freq_data=src,
                                                          label_set=label_set,
                                                          case_insensitive=case_insensitive)
@@ -333,7 +341,11 @@ def generate_sentence_bucketed_report(ref, outs, src=None,
       ref = ref_label = None
     aggregator = lambda out,refs,src: len(out)
   elif statistic_type == 'score':
-    scorer = scorers.create_scorer_from_profile(score_measure, case_insensitive=case_insensitive)
+    if bucket_type == 'score' and not case_insensitive:
+      # The bucketer already holds a scorer for the same measure
+      scorer = bucketer.scorer
+    else:
+      scorer = scorers.create_scorer_from_profile(score_measure, case_insensitive=case_insensitive)
     aggregator = lambda out,ref,src: scorer.score_corpus(ref,out,src)[0]
   else:
     raise ValueError(f'Illegal statistic_type {statistic_type}')
@@ -342,14 +354,27 @@ def generate_sentence_bucketed_report(ref, outs, src=None,
   cache_key_list = ['stats']
   stats = cache_utils.extract_cache_dicts(cache_dicts, cache_key_list, len(outs))
 
-  if cache_dicts is None:
+  bcs = None
+  sent_stats = scorer.cache_stats_multi(ref, outs, src) if cache_dicts is None and scorer is not None else None
+  if cache_dicts is None and statistic_type == 'count':
+    # Counts only need the bucket of each sentence, not the bucketed corpora themselves
+    stats = [bucketer.calc_bucket_counts(out, ref=ref, src=src, ref_labels=ref_labels if ref_labels else None, out_labels=out_labels[i] if out_labels else None) for i, out in enumerate(outs)]
+  elif cache_dicts is None and all(x is not None for x in sent_stats):
+    # Score each bucket from the sentence statistics of the whole corpus, which are computed only once
+    stats = []
+    for i, out in enumerate(outs):
+      bucket_ids = [[] for _ in bucketer.bucket_strs]
+      for sent_id, bucket in enumerate(bucketer.calc_corpus_buckets(out, ref=ref, src=src, ref_labels=ref_labels if ref_labels else None, out_labels=out_labels[i] if out_labels else None)):
+        bucket_ids[bucket].append(sent_id)
+      stats.append([scorer.score_cached_corpus(ids, sent_stats[i])[0] if ids else aggregator([], [], []) for ids in bucket_ids])
+  elif cache_dicts is None:
     bcs = [bucketer.create_bucketed_corpus(out, ref=ref, src=src, ref_labels=ref_labels if ref_labels else None, out_labels=out_labels[i] if out_labels else None) for i, out in enumerate(outs)]
     stats = [[aggregator(out,ref,src) for (out,ref,src) in bc] for bc in bcs]
 
   if output_bucket_details and statistic_type == 'score':
     bucket_cnt_calculator = lambda out,ref,src: len(out)
     bucket_interval_calculator = lambda out,ref: sign_utils.eval_with_paired_bootstrap(ref, [out], src, scorer, None)[1][0]
-    if cache_dicts is not None: # we don't cache bcs
+    if bcs is None: # we don't cache bcs
       bcs = [bucketer.create_bucketed_corpus(out, ref=ref, src=src,ref_labels=ref_labels if ref_labels else None, out_labels=out_labels[i] if out_labels else None) for i, out in enumerate(outs)]
     bucket_cnts = [bucket_cnt_calculator(out,ref,src) for (out,ref,src) in bcs[0]]
     bucket_intervals = [[bucket_interval_calculator(out,ref,src) for (out,ref,src) in bc] for bc in bcs]
@@ -375,6 +400,31 @@ def generate_sentence_bucketed_report(ref, outs, src=None,
   return reporter 
   
 
+def _calc_ngram_stats(ref, outs, ref_labels, out_labels, min_ngram_length, max_ngram_length, case_insensitive):
+  """
+  Count the n-grams compared by generate_ngram_report, going over the reference only once for all outputs
+
+  Args:
+    ref: Tokens from the reference
+    outs: Tokens from the output file(s)
+    ref_labels: A filename of reference labels, a list of reference labels, or None
+    out_labels: A list with a filename of labels for each output, or None
+    min_ngram_length: minimum n-gram length
+    max_ngram_length: maximum n-gram length
+    case_insensitive: A boolean specifying whether to turn on the case insensitive option
+
+  Returns:
+    A list with a tuple (total, match, over, under) for each output, as returned by `ngram_utils.compare_ngrams`
+  """
+  if not type(ref_labels) == str and case_insensitive:
+    ref = corpus_utils.lower(ref)
+    outs = [corpus_utils.lower(out) for out in outs]
+
+  ref_labels = corpus_utils.load_tokens(ref_labels) if type(ref_labels) == str else ref_labels
+  out_labels = [corpus_utils.load_tokens(x) for x in out_labels] if out_labels is not None else None
+  return ngram_utils.compare_ngrams_multi(ref, outs, ref_labels=ref_labels, out_labels=out_labels,
+                                          min_length=min_ngram_length, max_length=max_ngram_length)
+
 def generate_ngram_report(ref, outs,
                        min_ngram_length=1, max_ngram_length=4,
                        report_length=50, alpha=1.0, compare_type='match',
@@ -429,14 +479,8 @@ def generate_ngram_report(ref, outs,
   cache_key_list = ['totals', 'matches', 'overs', 'unders']
   totals, matches, overs, unders = cache_utils.extract_cache_dicts(cache_dicts, cache_key_list, len(outs))
   if cache_dicts is None:
-    if not type(ref_labels) == str and case_insensitive:
-      ref = corpus_utils.lower(ref)
-      outs = [corpus_utils.lower(out) for out in outs]
-
-    ref_labels = corpus_utils.load_tokens(ref_labels) if type(ref_labels) == str else ref_labels
-    out_labels = [corpus_utils.load_tokens(out_labels[i]) if not out_labels is None else None for i in range(len(outs))]
-    totals, matches, overs, unders = zip(*[ngram_utils.compare_ngrams(ref, out, ref_labels=ref_labels, out_labels=out_label,
-                                                             min_length=min_ngram_length, max_length=max_ngram_length) for out, out_label in zip(outs, out_labels)])
+    totals, matches, overs, unders = zip(*_calc_ngram_stats(ref, outs, ref_labels, out_labels,
+                                                            min_ngram_length, max_ngram_length, case_insensitive))
 
   if to_cache:
     cache_dict = cache_utils.return_cache_dict(cache_key_list, [totals, matches, overs, unders])
@@ -446,14 +490,26 @@ def generate_ngram_report(ref, outs,
   scores = []
   for (left, right) in direcs:
     if compare_type == 'match':
-      scores.append(stat_utils.extract_salient_features(matches[left], matches[right], alpha=alpha))
+      scores.append(stat_utils.extract_salient_feature_arrays(matches[left], matches[right], alpha=alpha))
     elif compare_type == 'over':
-      scores.append(stat_utils.extract_salient_features(overs[left], overs[right], alpha=alpha))
+      scores.append(stat_utils.extract_salient_feature_arrays(overs[left], overs[right], alpha=alpha))
     elif compare_type == 'under':
-      scores.append(stat_utils.extract_salient_features(unders[left], unders[right], alpha=alpha))
+      scores.append(stat_utils.extract_salient_feature_arrays(unders[left], unders[right], alpha=alpha))
     else:
       raise ValueError(f'Illegal compare_type "{compare_type}"')
-  scorelist = [sorted(score.items(), key=operator.itemgetter(1), reverse=True) for score in scores]
+  # The report only shows the report_length n-grams at either end of the ranking, so only rank those scoring
+  # at least the report_length-th highest or at most the report_length-th lowest score (a stable sort keeps
+  # ties in the same order as sorting everything)
+  scorelist = []
+  for keys, score in scores:
+    if 0 < 2 * report_length < len(score):
+      low, high = np.partition(score, [report_length-1, len(score)-report_length])[[report_length-1, len(score)-report_length]]
+      top, bottom = np.flatnonzero(score >= high), np.flatnonzero(score <= low)
+      ids = np.concatenate([top[np.argsort(-score[top], kind='stable')][:report_length],
+                            bottom[np.argsort(-score[bottom], kind='stable')][-report_length:]])
+    else:
+      ids = np.argsort(-score, kind='stable')
+    scorelist.append([(keys[i], v) for i, v in zip(ids.tolist(), score[ids].tolist())])
 
   # generate reports
   reporter = reporters.NgramReport(scorelist=scorelist, report_length=report_length,
@@ -469,12 +525,83 @@ def generate_ngram_report(ref, outs,
                            output_directory='outputs')
   return reporter
 
+# The arguments of the word accuracy reports that determine the word frequencies of a "freq" bucketer
+_freq_count_args = ('freq_count_file', 'freq_corpus_file', 'case_insensitive')
+
+def _share_freq_counts(freq_data, profiles):
+  """
+  Count the word frequencies once for word accuracy report profiles that bucket words by the same frequencies
+
+  Args:
+    freq_data: The corpus that frequencies are counted from if no file is given (the reference, or the source)
+    profiles: A list of parsed profiles for generate_word_accuracy_report or generate_src_word_accuracy_report
+
+  Returns:
+    The profiles, where the ones that use the same frequencies as another profile get them as freq_counts
+  """
+  groups = {}
+  for profile in profiles:
+    if profile.get('bucket_type', 'freq') == 'freq':
+      groups.setdefault(tuple(profile.get(k) for k in _freq_count_args), []).append(profile)
+  for group in groups.values():
+    if len(group) > 1:
+      freq_count_file, freq_corpus_file, case_insensitive = (group[0].get(k) for k in _freq_count_args)
+      bucketer = bucketers.FreqWordBucketer(freq_count_file=freq_count_file, freq_corpus_file=freq_corpus_file,
+                                            freq_data=freq_data, case_insensitive=case_insensitive == 'True')
+      for profile in group:
+        profile['freq_counts'] = bucketer.freq_counts
+  return profiles
+
+# The arguments of generate_ngram_report that determine which n-grams are counted
+_ngram_stat_args = ('ref_labels', 'out_labels', 'min_ngram_length', 'max_ngram_length', 'case_insensitive')
+
+def _share_ngram_stats(ref, outs, profiles):
+  """
+  Count the n-grams once for n-gram report profiles that only differ in how they compare them (e.g. compare_type)
+
+  Args:
+    ref: Tokens from the reference
+    outs: Tokens from the output file(s)
+    profiles: A list of parsed profiles for generate_ngram_report
+
+  Returns:
+    The profiles, where the ones that count the same n-grams as another profile get the statistics as cache_dicts
+  """
+  groups = {}
+  for profile in profiles:
+    groups.setdefault(tuple(profile.get(k) for k in _ngram_stat_args), []).append(profile)
+  for group in groups.values():
+    profile = group[0]
+    out_labels = arg_utils.parse_files(profile['out_labels']) if 'out_labels' in profile else None
+    # Leave profiles with the wrong number of output labels to generate_ngram_report, which reports the error
+    if len(group) > 1 and (out_labels is None or len(out_labels) == len(outs)):
+      stats = _calc_ngram_stats(ref, outs, profile.get('ref_labels'), out_labels,
+                                int(profile.get('min_ngram_length', 1)), int(profile.get('max_ngram_length', 4)),
+                                profile.get('case_insensitive') == 'True')
+      cache_dicts = [cache_utils.return_cache_dict(['totals', 'matches', 'overs', 'unders'], [[x] for x in out_stats])
+                     for out_stats in stats]
+      for profile in group:
+        profile['cache_dicts'] = cache_dicts
+  return profiles
+
+# The scorer used by each worker process of generate_sentence_examples
+_worker_scorer = None
+
+def _init_worker_scorer(score_type, case_insensitive):
+  global _worker_scorer
+  _worker_scorer = scorers.create_scorer_from_profile(score_type, case_insensitive=case_insensitive)
+
+def _score_sentence_outs(args):
+  ref_sent, out_sents, src_sent = args
+  return [_worker_scorer.score_sentence(ref_sent, out_sent, src_sent) for out_sent in out_sents]
+
 def generate_sentence_examples(ref, outs, src=None,
                             score_type='sentbleu',
                             report_length=10,
                             compare_directions='0-1',
                             title=None,
                             case_insensitive=False,
+                            num_workers=1,
                             to_cache=False,
                             cache_dicts=None):
   """
@@ -489,11 +616,13 @@ def generate_sentence_examples(ref, outs, src=None,
     compare_directions: A string specifying which systems to compare
     title: A string specifying the caption of the printed table
     case_insensitive: A boolean specifying whether to turn on the case insensitive option
+    num_workers: Number of processes to score sentences with
     to_cache: Return a list of computed statistics if True
     cache_dicts: A list of dictionaries that store cached statistics for each output
   """
   # check and set parameters
   report_length = int(report_length)
+  num_workers = int(num_workers)
   if type(case_insensitive) == str:
     case_insensitive = True if case_insensitive == 'True' else False
 
@@ -505,15 +634,24 @@ def generate_sentence_examples(ref, outs, src=None,
   scores, strs = cache_utils.extract_cache_dicts(cache_dicts, cache_key_list, len(outs))
   src = [None for _ in ref] if src is None else src
   if cache_dicts is None:
-    scores, strs = [], []
-    for out in outs:
-      scores_i, strs_i = [], []
-      for (r, o, s) in zip(ref, out, src):
-        score, string = scorer.score_sentence(r, o, s)
-        scores_i.append(score)
-        strs_i.append(string)
-      scores.append(scores_i)
-      strs.append(strs_i)
+    # Score all systems in a single pass over the corpus so each reference is visited once
+    scores, strs = [[] for _ in outs], [[] for _ in outs]
+    def add_sentence_scores(sent_results):
+      for results in sent_results:
+        for j, (score, string) in enumerate(results):
+          scores[j].append(score)
+          strs[j].append(string)
+    tasks = zip(ref, zip(*outs), src)
+    if num_workers > 1:
+      # Sentences are scored independently, so spread them over a pool of processes that
+      # each build their own scorer
+      with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,
+                                                  initializer=_init_worker_scorer,
+                                                  initargs=(score_type, case_insensitive)) as executor:
+        chunksize = max(1, len(ref) // (4 * num_workers))
+        add_sentence_scores(executor.map(_score_sentence_outs, tasks, chunksize=chunksize))
+    else:
+      add_sentence_scores([scorer.score_sentence(r, o, s) for o in os] for (r, os, s) in tasks)
   
   if to_cache:
     cache_dict = cache_utils.return_cache_dict(cache_key_list, [scores, strs])
@@ -523,15 +661,21 @@ def generate_sentence_examples(ref, outs, src=None,
 
   scorediff_lists = []
   for (left, right) in direcs:
-    scorediff_list = []
+    sent_ids = []
     deduplicate_set = set()
     for i, (o1, o2, r) in enumerate(zip(outs[left], outs[right], ref)):
       if (tuple(o1), tuple(o2), tuple(r)) in deduplicate_set:
         continue
       deduplicate_set.add( (tuple(o1), tuple(o2), tuple(r)) )
-      s1, str1 = scores[left][i], strs[left][i]
-      s2, str2 = scores[right][i], strs[right][i]
-      scorediff_list.append((s2-s1, s1, s2, str1, str2, i))
+      sent_ids.append(i)
+    # The report only looks at the report_length examples at either end, so only build and sort
+    # the entries whose score difference is within the report_length smallest or largest ones
+    if 0 < 2 * report_length < len(sent_ids):
+      diffs = np.asarray(scores[right], dtype=float)[sent_ids] - np.asarray(scores[left], dtype=float)[sent_ids]
+      low, high = np.partition(diffs, [report_length-1, len(diffs)-report_length])[[report_length-1, len(diffs)-report_length]]
+      sent_ids = [sent_ids[j] for j in np.flatnonzero((diffs <= low) | (diffs >= high))]
+    scorediff_list = [(scores[right][i]-scores[left][i], scores[left][i], scores[right][i], strs[left][i], strs[right][i], i)
+                      for i in sent_ids]
     scorediff_list.sort()
     scorediff_lists.append(scorediff_list)
 
@@ -544,6 +688,34 @@ def generate_sentence_examples(ref, outs, src=None,
   reporter.generate_report()
   return reporter 
 
+# The corpora shared by the report worker processes of main()
+_worker_corpora = None
+
+# The number of figure ids that each type of report takes from reporters.next_fig_id()
+_report_fig_counts = {
+  generate_score_report: 1,
+  generate_word_accuracy_report: 1,
+  generate_src_word_accuracy_report: 1,
+  generate_sentence_bucketed_report: 1,
+  generate_ngram_report: 0,
+  generate_sentence_examples: 0,
+}
+
+def _init_report_worker(corpora, sys_names, fig_size, decimals, scorer_scale):
+  global _worker_corpora
+  _worker_corpora = corpora
+  reporters.sys_names, reporters.fig_size = sys_names, fig_size
+  formatting.fmt.set_decimals(decimals)
+  scorers.global_scorer_scale = scorer_scale
+
+def _generate_report_in_worker(func, use_src, profile, fig_counter):
+  ref, outs, src = _worker_corpora
+  # Number figures as a serial run would, so that reports from different workers don't clash
+  reporters.fig_counter = fig_counter
+  with contextlib.redirect_stdout(io.StringIO()) as printed:
+    report = func(ref, outs, src, **profile) if use_src else func(ref, outs, **profile)
+  return report, printed.getvalue()
+
 def main():
   parser = argparse.ArgumentParser(
       description='Program to compare MT results',
@@ -612,6 +784,9 @@ def main():
                       help="Seed for random number generation")
   parser.add_argument('--scorer_scale', type=float, default=100, choices=[1, 100],
                       help="Set the scale of BLEU, METEOR, WER, chrF and COMET to 0-1 or 0-100 (default 0-100)")
+  parser.add_argument('--num_workers', type=int, default=1,
+                      help="Number of processes to generate reports with. The printed reports keep their order. "
+                           "With --seed, reports share one stream of random numbers, so they are generated serially")
   parser.add_argument('--http', type=int, dest='bind_port',
                       help='Launch an HTTP server at specified port to view results.'
                            'Disabled by default, but specifying a port number enabled it.')
@@ -650,12 +825,43 @@ def main():
       (args.compare_sentence_examples, generate_sentence_examples, 'Sentence Examples', True),
     ]
 
-  for arg, func, name, use_src in report_types:
-    if arg is not None:
-      if use_src:
-        reports.append( (name, [func(ref, outs, src, **arg_utils.parse_profile(x)) for x in arg]) )
-      else:
-        reports.append( (name, [func(ref, outs, **arg_utils.parse_profile(x)) for x in arg]) )
+  if args.num_workers > 1 and args.seed is None:
+    # Every profile is an independent report, so generate them all in a pool of processes and print
+    # their output in the usual order as they are collected
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.num_workers,
+                                                initializer=_init_report_worker,
+                                                initargs=((ref, outs, src), reporters.sys_names, reporters.fig_size,
+                                                          args.decimals, args.scorer_scale)) as executor:
+      futures, fig_counter = [], reporters.fig_counter
+      for arg, func, name, use_src in report_types:
+        if arg is not None:
+          name_futures = []
+          for x in arg:
+            name_futures.append(executor.submit(_generate_report_in_worker, func, use_src,
+                                                arg_utils.parse_profile(x), fig_counter))
+            fig_counter += _report_fig_counts[func]
+          futures.append( (name, name_futures) )
+      for name, name_futures in futures:
+        name_reports = []
+        for future in name_futures:
+          report, printed = future.result()
+          print(printed, end='')
+          name_reports.append(report)
+        reports.append( (name, name_reports) )
+  else:
+    for arg, func, name, use_src in report_types:
+      if arg is not None:
+        profiles = [arg_utils.parse_profile(x) for x in arg]
+        if func is generate_ngram_report:
+          profiles = _share_ngram_stats(ref, outs, profiles)
+        elif func is generate_word_accuracy_report:
+          profiles = _share_freq_counts(ref, profiles)
+        elif func is generate_src_word_accuracy_report and src is not None:
+          profiles = _share_freq_counts(src, profiles)
+        if use_src:
+          reports.append( (name, [func(ref, outs, src, **profile) for profile in profiles]) )
+        else:
+          reports.append( (name, [func(ref, outs, **profile) for profile in profiles]) )
 
   # Write all reports into a single html file
   if args.output_directory != None:
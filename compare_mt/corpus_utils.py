@@ -1,3 +1,5 @@
+import re
+
 def iterate_tokens(filename):
   with open(filename, "r", encoding="utf-8") as f:
     for line in f:
@@ -14,19 +16,27 @@ def iterate_nums(filename):
 def load_nums(filename):
   return list(iterate_nums(filename))
 
+# A line of space-separated "src-trg" index pairs
+_alignment_line_re = re.compile(r'\d+-\d+(?: \d+-\d+)*')
+
 def iterate_alignments(filename):
   with open(filename, "r", encoding="utf-8") as f:
     for line in f:
-      try:
-        yield [(int(src),int(trg)) for (src,trg) in [x.split('-') for x in line.strip().split(' ')]]
-      except:
+      pairs = line.strip()
+      if not _alignment_line_re.fullmatch(pairs):
         raise ValueError(f'Poorly formed alignment line in {filename}:\n{line}')
+      # Once the line is validated, read all indices in one go and pair them up
+      idxs = map(int, pairs.replace('-', ' ').split(' '))
+      yield list(zip(idxs, idxs))
 
 def load_alignments(filename):
   return list(iterate_alignments(filename))
 
 def lower(inp):
-  return inp.lower() if type(inp) == str else [lower(x) for x in inp]
+  if type(inp) == str:
+    return inp.lower()
+  # Lower the words of a sentence directly rather than with a recursive call for each of them
+  return [x.lower() if type(x) == str else lower(x) for x in inp]
 
 def list2str(l):
   string = ''
@@ -1,5 +1,6 @@
-from collections import defaultdict
+from collections import Counter
 import itertools
+import numpy as np
 
 def sent_ngrams_list(words, n):
   """
@@ -12,11 +13,8 @@ def sent_ngrams_list(words, n):
   Returns:
     A list of n-grams in the sentence
   """
-  word_ngram = []
-  for i in range(len(words) - n + 1):
-    ngram = tuple(words[i:i + n])
-    word_ngram.append(ngram)
-  return word_ngram
+  # Zipping shifted views of the sentence builds all the n-gram tuples at C level
+  return list(zip(*[words[i:] for i in range(n)]))
 
 def iterate_sent_ngrams(words, labels=None, min_length=1, max_length=4):
   """
@@ -34,11 +32,10 @@ def iterate_sent_ngrams(words, labels=None, min_length=1, max_length=4):
   if labels is not None and len(labels) != len(words):
     raise ValueError(f'length of labels and sentence must be the same but got'
                      f' {len(words)} != {len(labels)} at\n{words}\n{labels}')
-  for n in range(min_length-1, max_length):
-    for i in range(len(words) - n):
-      word_ngram = tuple(words[i:i + n + 1])
-      label_ngram = tuple(labels[i:i + n + 1]) if (labels is not None) else word_ngram
-      yield word_ngram, label_ngram
+  for n in range(min_length, max_length+1):
+    word_ngrams = sent_ngrams_list(words, n)
+    label_ngrams = sent_ngrams_list(labels, n) if (labels is not None) else word_ngrams
+    yield from zip(word_ngrams, label_ngrams)
 
 def compare_ngrams(ref, out, ref_labels=None, out_labels=None, min_length=1, max_length=4):
   """
@@ -61,27 +58,121 @@ def compare_ngrams(ref, out, ref_labels=None, out_labels=None, min_length=1, max
   """
   if (ref_labels is None) != (out_labels is None):
     raise ValueError('ref_labels or out_labels must both be either None or not None')
-  total, match, over, under = [defaultdict(lambda: 0) for _ in range(4)]
-  if ref_labels is None: ref_labels = []
-  if out_labels is None: out_labels = []
-  for ref_sent, out_sent, ref_lab, out_lab in itertools.zip_longest(ref, out, ref_labels, out_labels):
+  return compare_ngrams_multi(ref, [out], ref_labels=ref_labels,
+                              out_labels=None if out_labels is None else [out_labels],
+                              min_length=min_length, max_length=max_length)[0]
+
+def compare_ngrams_multi(ref, outs, ref_labels=None, out_labels=None, min_length=1, max_length=4):
+  """
+  Compare n-grams appearing in the reference sentences and several outputs, counting the reference n-grams only once
+
+  Args:
+    ref: A list of reference sentences
+    outs: A list of output corpora
+    ref_labels: Alternative labels for reference words (e.g. POS tags) to use when aggregating counts
+    out_labels: A list of alternative labels for the words of each output
+    min_length: The minimum length of n-grams to consider
+    max_length: The maximum length of n-grams to consider
+
+  Returns:
+    A list with a tuple (total, match, over, under) for each output, as returned by `compare_ngrams`
+  """
+  if (ref_labels is None) != (out_labels is None):
+    raise ValueError('ref_labels or out_labels must both be either None or not None')
+  if ref_labels is None:
+    return _compare_ngram_ids(ref, outs, min_length=min_length, max_length=max_length)
+  stats = [[Counter() for _ in range(4)] for _ in outs]
+  for ref_sent, ref_lab, *sys_sents in itertools.zip_longest(ref, ref_labels, *outs, *out_labels):
     # Find the number of reference n-grams (on a word level)
     ref_ngrams = list(iterate_sent_ngrams(ref_sent, labels=ref_lab, min_length=min_length, max_length=max_length))
-    ref_word_counts = defaultdict(lambda: 0)
-    for ref_w, ref_l in ref_ngrams:
-      ref_word_counts[ref_w] += 1
-    # Step through the output ngrams and find matched and overproduced ones
-    for out_w, out_l in iterate_sent_ngrams(out_sent, labels=out_lab, min_length=min_length, max_length=max_length):
-      total[out_l] += 1
-      if ref_word_counts[out_w] > 0:
-        match[out_l] += 1
-        ref_word_counts[out_w] -= 1
-      else:
-        over[out_l] += 1
-    # Remaining ones are underproduced
-    # (do reverse order just to make ordering consistent for over and under, shouldn't matter much)
-    for ref_w, ref_l in reversed(ref_ngrams):
-      if ref_word_counts[ref_w] > 0:
-        under[ref_l] += 1
-        ref_word_counts[ref_w] -= 1
-  return total, match, over, under
+    ref_counts = Counter(ref_w for ref_w, _ in ref_ngrams)
+    for (total, match, over, under), out_sent, out_lab in zip(stats, sys_sents[:len(outs)], sys_sents[len(outs):]):
+      ref_word_counts = ref_counts.copy()
+      # Step through the output ngrams and find matched and overproduced ones
+      for out_w, out_l in iterate_sent_ngrams(out_sent, labels=out_lab, min_length=min_length, max_length=max_length):
+        total[out_l] += 1
+        if ref_word_counts[out_w] > 0:
+          match[out_l] += 1
+          ref_word_counts[out_w] -= 1
+        else:
+          over[out_l] += 1
+      # Remaining ones are underproduced
+      # (do reverse order just to make ordering consistent for over and under, shouldn't matter much)
+      for ref_w, ref_l in reversed(ref_ngrams):
+        if ref_word_counts[ref_w] > 0:
+          under[ref_l] += 1
+          ref_word_counts[ref_w] -= 1
+  return [tuple(x) for x in stats]
+
+def _compare_ngram_ids(ref, outs, min_length=1, max_length=4):
+  """
+  An implementation of `compare_ngrams_multi` without labels that works on integer IDs instead of strings.
+
+  Every word is mapped to an ID, and every n-gram to the ID of the pair (ID of its first n-1 words, last word),
+  so n-grams can be counted per sentence and matched against the reference with NumPy.
+  N-gram tuples are only created at the end, once for each distinct n-gram.
+  """
+  corpora = [ref] + list(outs)
+  num_sents = max(map(len, corpora))
+  vocab = {}
+  lengths = [np.fromiter(map(len, corpus), dtype=np.int64, count=len(corpus)) for corpus in corpora]
+  words = np.concatenate([np.fromiter((vocab.setdefault(w, len(vocab)) for w in itertools.chain.from_iterable(corpus)),
+                                      dtype=np.int64, count=int(length.sum()))
+                          for corpus, length in zip(corpora, lengths)])
+  # The sentence that each word belongs to, numbered over all corpora
+  sents = np.concatenate([np.repeat(np.arange(len(length)) + i * num_sents, length) for i, length in enumerate(lengths)])
+  vocab_size = len(vocab)
+
+  # Find the n-gram starting at each position for each n, with IDs that are consecutive over all lengths
+  gram_ids, gram_sents, prefixes = [], [], []
+  starts = np.arange(len(words))
+  prev_ids, num_grams = words, vocab_size
+  for n in range(1, max_length+1):
+    if n > 1:
+      starts = starts[starts + n - 1 < len(words)]
+      starts = starts[sents[starts + n - 1] == sents[starts]]
+      keys = prev_ids[starts] * vocab_size + words[starts + n - 1]
+      uniq_keys, inv = np.unique(keys, return_inverse=True)
+      prev_ids = np.full(len(words), -1, dtype=np.int64)
+      prev_ids[starts] = inv
+      prefixes.append((uniq_keys // vocab_size + num_grams - prev_num, uniq_keys % vocab_size))
+      prev_num = len(uniq_keys)
+      num_grams += prev_num
+    else:
+      prev_num = vocab_size
+    if n >= min_length:
+      gram_ids.append(prev_ids[starts] + num_grams - prev_num)
+      gram_sents.append(sents[starts])
+  gram_ids = np.concatenate(gram_ids) if gram_ids else np.zeros(0, dtype=np.int64)
+  gram_sents = np.concatenate(gram_sents) if gram_sents else np.zeros(0, dtype=np.int64)
+
+  # Count each n-gram in each sentence, and split the counts into those of the reference and each output
+  uniq_keys, counts = np.unique(gram_sents * num_grams + gram_ids, return_counts=True)
+  corpus_bounds = np.searchsorted(uniq_keys, np.arange(len(corpora) + 1) * num_sents * num_grams)
+  sent_counts = [(uniq_keys[b:e] - i * num_sents * num_grams, counts[b:e])
+                 for i, (b, e) in enumerate(zip(corpus_bounds, corpus_bounds[1:]))]
+
+  # Create the n-gram tuples, where each n-gram extends an (n-1)-gram that was created before it
+  vocab_words = list(vocab)
+  grams = [(w,) for w in vocab_words]
+  for prefix_ids, last_words in prefixes:
+    grams.extend(grams[p] + (vocab_words[w],) for p, w in zip(prefix_ids.tolist(), last_words.tolist()))
+
+  def _lookup(keys, other_keys, other_counts):
+    idx = np.minimum(np.searchsorted(other_keys, keys), max(len(other_keys) - 1, 0))
+    return np.where(other_keys[idx] == keys, other_counts[idx], 0) if len(other_keys) else np.zeros_like(keys)
+
+  def _to_dict(gram_counts):
+    nonzero = np.flatnonzero(gram_counts)
+    return Counter(dict(zip(map(grams.__getitem__, nonzero.tolist()), gram_counts[nonzero].tolist())))
+
+  ref_keys, ref_counts = sent_counts[0]
+  ret = []
+  for out_keys, out_counts in sent_counts[1:]:
+    match_counts = np.minimum(out_counts, _lookup(out_keys, ref_keys, ref_counts))
+    under_counts = ref_counts - np.minimum(ref_counts, _lookup(ref_keys, out_keys, out_counts))
+    out_grams, ref_grams = out_keys % num_grams, ref_keys % num_grams
+    ret.append(tuple(_to_dict(np.bincount(g, weights=c, minlength=num_grams).astype(np.int64))
+                     for g, c in ((out_grams, out_counts), (out_grams, match_counts),
+                                  (out_grams, out_counts - match_counts), (ref_grams, under_counts))))
+  return ret
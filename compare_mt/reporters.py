@@ -109,8 +109,11 @@ def make_bar_chart(datas,
 
   if not os.path.exists(output_directory):
     os.makedirs(output_directory)
-  out_file = os.path.join(output_directory, f'{output_fig_file}.{output_fig_format}')
-  plt.savefig(out_file, format=output_fig_format, bbox_inches='tight')
+  # Draw the chart once and save it in every requested format, then release the figure
+  for fig_format in ([output_fig_format] if isinstance(output_fig_format, str) else output_fig_format):
+    out_file = os.path.join(output_directory, f'{output_fig_file}.{fig_format}')
+    fig.savefig(out_file, format=fig_format, bbox_inches='tight')
+  plt.close(fig)
 
 def html_img_reference(fig_file, title):
   latex_code_pieces = [r"\begin{figure}[h]",
@@ -225,8 +228,7 @@ class ScoreReport(Report):
     html = html_table(aggregate_table, title=self.title)
     if win_table:
       html += html_table(win_table, title=f'{self.scorer.name()} Wins')
-    for ext in ('png', 'pdf'):
-      self.plot(output_directory, self.output_fig_file, ext)
+    self.plot(output_directory, self.output_fig_file, ('png', 'pdf'))
     html += html_img_reference(self.output_fig_file, 'Score Comparison')
     return html
     
@@ -406,8 +408,7 @@ class WordReport(Report):
         table += [line] 
       html += html_table(table, title, latex_ignore_cols={3})
       img_name = f'{self.output_fig_file}-{at}'
-      for ext in ('png', 'pdf'):
-        self.plot(output_directory, img_name, ext)
+      self.plot(output_directory, img_name, ('png', 'pdf'))
       html += html_img_reference(img_name, self.header)
     return html 
 
@@ -556,8 +557,7 @@ class SentenceReport(Report):
           line[-1] += f'<font size=2> [{fmt(low)}, {fmt(up)}]</font>'
       table.extend([line])
     html = html_table(table, self.title)
-    for ext in ('png', 'pdf'):
-      self.plot(output_directory, self.output_fig_file, ext)
+    self.plot(output_directory, self.output_fig_file, ('png', 'pdf'))
     html += html_img_reference(self.output_fig_file, 'Sentence Bucket Analysis')
     return html 
 
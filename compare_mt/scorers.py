@@ -33,6 +33,21 @@ class Scorer(object):
   def cache_stats(self, ref, out, src=None):
     return None
 
+  def cache_stats_multi(self, ref, outs, src=None):
+    """
+    Cache sufficient statistics for several outputs of the same reference.
+    Scorers can override this to process each reference sentence only once.
+
+    Args:
+      ref: A reference corpus
+      outs: A list of output corpora
+      src: A source corpus. Might be ignored or required depending on the metric
+
+    Returns:
+      A list with the cached statistics of each output, as returned by `cache_stats`
+    """
+    return [self.cache_stats(ref, out, src=src) for out in outs]
+
   def name(self):
     """
     A name that can have spaces that describes the scorer.
@@ -134,28 +149,24 @@ class BleuScorer(Scorer):
     raise NotImplementedError("Sentence-level calculation is not implemented in BleuScorer as it is usually 0."
                               "Consider using SentenceBleuScorer (string sentbleu) instead.")
 
-  def _precision(self, ref, out, n):
+  def _precision(self, ref_cnt, out, n):
     """
     Caculate n-gram precision 
 
     Args:
-      ref: A reference sentence
+      ref_cnt: The n-gram counts of a reference sentence
       out: An output sentence
 
     Returns:
       Numerator and denominator of the precision
     """
     out_ngram = ngram_utils.sent_ngrams_list(out, n)
-    ref_ngram = ngram_utils.sent_ngrams_list(ref, n)
     out_cnt = Counter(out_ngram)
-    ref_cnt = Counter(ref_ngram)
 
-    num = 0
-    denom = 0
-    for ngram, o_cnt in out_cnt.items():
-      num += min(o_cnt, ref_cnt[ngram])
-      denom += o_cnt
-    denom = max(1, denom)
+    # Only n-grams in both sentences contribute matches, so intersect the key views instead of
+    # looking up every output n-gram in the reference
+    num = sum([min(out_cnt[ngram], ref_cnt[ngram]) for ngram in out_cnt.keys() & ref_cnt.keys()])
+    denom = max(1, len(out_ngram))
 
     return num, denom
 
@@ -169,21 +180,40 @@ class BleuScorer(Scorer):
       src: A source courpus. Ignored if passed
 
     Returns:
-      A list of cached statistics
+      An integer array of cached statistics with one row per sentence, holding the reference length,
+      the output length, and the numerator and denominator of each n-gram precision
+    """
+    return self.cache_stats_multi(ref, [out])[0]
+
+  def cache_stats_multi(self, ref, outs, src=None):
+    """
+    Cache sufficient statistics for caculating BLEU score of several outputs, counting the n-grams of each
+    reference sentence only once
+
+    Args:
+      ref: A reference corpus
+      outs: A list of output corpora
+      src: A source courpus. Ignored if passed
+
+    Returns:
+      A list with the cached statistics of each output, as returned by `cache_stats`
     """
     if self.case_insensitive:
       ref = corpus_utils.lower(ref)
-      out = corpus_utils.lower(out)
+      outs = [corpus_utils.lower(out) for out in outs]
 
-    cached_stats = []
+    cached_stats = [[] for _ in outs]
 
-    for r, o in zip(ref, out):
-      prec = []
-      for n in range(1, len(self.weights) + 1):
-        prec.append(self._precision(r, o, n))
-      cached_stats.append( (len(r), len(o), prec) )
+    for i, r in enumerate(ref):
+      ref_cnts = [Counter(ngram_utils.sent_ngrams_list(r, n)) for n in range(1, len(self.weights) + 1)]
+      for out, out_stats in zip(outs, cached_stats):
+        if i < len(out):
+          stat = [len(r), len(out[i])]
+          for n, ref_cnt in enumerate(ref_cnts, start=1):
+            stat.extend(self._precision(ref_cnt, out[i], n))
+          out_stats.append(stat)
 
-    return cached_stats
+    return [np.array(stats, dtype=np.int64).reshape(-1, 2 + 2 * len(self.weights)) for stats in cached_stats]
 
   def score_cached_corpus(self, sent_ids, cached_stats):
     """
@@ -199,26 +229,16 @@ class BleuScorer(Scorer):
     if len(cached_stats) == 0:
       return 0.0, None
 
-    cached_ref_len, cached_out_len, cached_prec = zip(*cached_stats)
-
-    num_prec = Counter()
-    denom_prec = Counter()
+    # Gather the sentences and sum up their statistics in one go
+    totals = cached_stats[np.asarray(sent_ids, dtype=int)].sum(0).tolist()
+    ref_len, out_len = totals[0], totals[1]
+    num_prec, denom_prec = totals[2::2], totals[3::2]
 
-    ref_len = 0
-    out_len = 0
-    for sent_id in sent_ids:
-      ref_len += cached_ref_len[sent_id]
-      out_len += cached_out_len[sent_id]
-      for n in range(1, len(self.weights) + 1):
-        num, denom = cached_prec[sent_id][n-1]
-        num_prec[n] += num
-        denom_prec[n] += denom
-
-    if num_prec[1] == 0:
+    if num_prec[0] == 0:
       return 0, None
 
     prec = 0
-    for i, w in enumerate(self.weights, start=1):
+    for i, w in enumerate(self.weights):
       p = num_prec[i] / denom_prec[i] if denom_prec[i] != 0 else 0
       p = math.log(p) if p > 0 else 0
       prec += p * w
@@ -239,6 +259,7 @@ class SentBleuScorer(SentenceFactoredScorer):
   """
   def __init__(self, case_insensitive=False):
     self.case_insensitive = case_insensitive
+    self._smoothing_function = nltk.translate.bleu_score.SmoothingFunction().method2
 
   @property
   def scale(self):
@@ -256,11 +277,10 @@ class SentBleuScorer(SentenceFactoredScorer):
     Returns:
       The sentence-level BLEU score, and None
     """
-    chencherry = nltk.translate.bleu_score.SmoothingFunction()
     if self.case_insensitive:
-      bleu_score = nltk.translate.bleu_score.sentence_bleu([corpus_utils.lower(ref)], corpus_utils.lower(out), smoothing_function=chencherry.method2)
+      bleu_score = nltk.translate.bleu_score.sentence_bleu([corpus_utils.lower(ref)], corpus_utils.lower(out), smoothing_function=self._smoothing_function)
     else:
-      bleu_score = nltk.translate.bleu_score.sentence_bleu([ref], out, smoothing_function=chencherry.method2)
+      bleu_score = nltk.translate.bleu_score.sentence_bleu([ref], out, smoothing_function=self._smoothing_function)
     return self.scale * bleu_score, None
 
   def name(self):
@@ -285,12 +305,46 @@ class LengthScorer(Scorer):
     Returns:
       A tuple containing a single value for the length ratio and a string summarizing auxiliary information
     """
-    ref_words = sum([len(x) for x in ref])
-    out_words = sum([len(x) for x in out])
+    ref_words = sum(map(len, ref))
+    out_words = sum(map(len, out))
+    return self._score_lengths(ref_words, out_words)
+
+  def _score_lengths(self, ref_words, out_words):
     if ref_words == 0:
       return 0.0, f'ref={ref_words}, out={out_words}'
     return self.scale * out_words / ref_words, f'ref={ref_words}, out={out_words}'
 
+  def cache_stats(self, ref, out, src=None):
+    """
+    Cache sufficient statistics for caculating the length ratio
+
+    Args:
+      ref: A reference corpus
+      out: An output corpus
+      src: A source courpus. Ignored if passed
+
+    Returns:
+      An integer array of cached statistics with one row per sentence, holding the reference and output length
+    """
+    lengths = np.zeros((len(ref), 2), dtype=np.int64)
+    lengths[:,0] = np.fromiter(map(len, ref), dtype=np.int64, count=len(ref))
+    lengths[:,1] = np.fromiter(map(len, out), dtype=np.int64, count=len(ref))
+    return lengths
+
+  def score_cached_corpus(self, sent_ids, cached_stats):
+    """
+    Calculate the length ratio with cache
+
+    Args:
+      sent_ids: The sentence ids for reference and output corpora
+      cached_stats: A list of cached statistics
+
+    Returns:
+      A tuple containing a single value for the length ratio and a string summarizing auxiliary information
+    """
+    ref_words, out_words = cached_stats[np.asarray(sent_ids, dtype=int)].sum(0).tolist()
+    return self._score_lengths(ref_words, out_words)
+
   def score_sentence(self, ref, out, src=None):
     """
     Score a single sentence by length ratio
@@ -383,10 +437,23 @@ class RibesScorer(SentenceFactoredScorer):
     n = len(alignment)
     if n <= 1:
       return 0
-    for i in range(n):
-      for j in range(i+1, n):
-        if alignment[j] > alignment[i]:
-          dis += 1
+    # A strictly increasing (monotone) alignment has every pair ascending
+    if all(x < y for x, y in zip(alignment, alignment[1:])):
+      return 1.0
+    # Count the ascending pairs in O(n log n) with a Fenwick tree over the ranks of the values,
+    # which holds how many of the elements seen so far have each rank
+    ranks = {x: r for r, x in enumerate(sorted(set(alignment)), start=1)}
+    tree = [0] * (len(ranks) + 1)
+    for x in alignment:
+      r = ranks[x]
+      i = r - 1
+      while i > 0:
+        dis += tree[i]
+        i -= i & -i
+      i = r
+      while i < len(tree):
+        tree[i] += 1
+        i += i & -i
     return 2*dis/(n*n-n)
 
   def score_sentence(self, ref, out, src=None):
@@ -42,13 +42,13 @@ def eval_with_paired_bootstrap(ref, outs, src,
   ids = list(range(n))
 
   if cache_stats is None:
-    cache_stats = [scorer.cache_stats(ref, out, src=src) for out in outs]
+    cache_stats = scorer.cache_stats_multi(ref, outs, src=src)
   sample_size = int(n*sample_ratio)
   for _ in range(num_samples):
     # Subsample the gold and system outputs (with replacement)
     reduced_ids = np.random.choice(ids, size=sample_size, replace=True)
     # Calculate accuracy on the reduced sample and save stats
-    if cache_stats[0]:
+    if cache_stats[0] is not None and len(cache_stats[0]) > 0:
       sys_score, _ = zip(*[scorer.score_cached_corpus(reduced_ids, cache_stat) for cache_stat in cache_stats])
     else:
       reduced_ref = [ref[i] for i in reduced_ids]
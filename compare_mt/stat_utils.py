@@ -1,3 +1,4 @@
+import numpy as np
 
 def extract_salient_features(dict1, dict2, alpha=1.0):
   """
@@ -11,8 +12,23 @@ def extract_salient_features(dict1, dict2, alpha=1.0):
   Returns:
     Laplace smoothed differences between features
   """
-  all_keys = set(dict1.keys()) | set(dict2.keys())
-  scores = {}
-  for k in all_keys:
-    scores[k] = (dict1[k]+alpha) / (dict1[k] + dict2[k] + 2*alpha)
-  return scores
\ No newline at end of file
+  keys, scores = extract_salient_feature_arrays(dict1, dict2, alpha=alpha)
+  return dict(zip(keys, scores.tolist()))
+
+def extract_salient_feature_arrays(dict1, dict2, alpha=1.0):
+  """
+  Score salient features given to dictionaries, like `extract_salient_features`, but without building a dictionary.
+
+  Args:
+    dict1: First set of feature coutns
+    dict2: Second set of feature counts
+    alpha: The amount of smoothing (default 1 to Laplace smoothed probabilities)
+
+  Returns:
+    A tuple containing a list of the features, and an array of their Laplace smoothed differences
+  """
+  # Keep the features in the order they were counted, so that ties are broken the same way in every process
+  all_keys = list(dict1) + [k for k in dict2 if k not in dict1]
+  counts1 = np.fromiter((dict1.get(k, 0) for k in all_keys), dtype=float, count=len(all_keys))
+  counts2 = np.fromiter((dict2.get(k, 0) for k in all_keys), dtype=float, count=len(all_keys))
+  return all_keys, (counts1+alpha) / (counts1 + counts2 + 2*alpha)
@@ -1,10 +1,9 @@
-from collections import defaultdict
+from collections import Counter
 import sys
 
-cnts = defaultdict(lambda: 0)
+cnts = Counter()
 for line in sys.stdin:
-  for word in line.strip().split():
-    cnts[word] += 1
+  cnts.update(line.strip().split())
 
-for k, v in sorted(cnts.items(), key=lambda x: -x[1]):
+for k, v in cnts.most_common():
   print(f'{k}\t{v}')
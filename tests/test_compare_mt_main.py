@@ -0,0 +1,68 @@
+import contextlib
+import io
+import os.path
+import unittest
+import sys
+import tempfile
+from unittest import mock
+
+compare_mt_root = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+sys.path.append(compare_mt_root)
+
+from compare_mt import compare_mt_main, reporters
+
+
+def _run_main(args):
+  # Figures and tables are numbered by module-level counters, so start every run from the first ones
+  with mock.patch.object(sys, 'argv', ['compare-mt'] + args), \
+       mock.patch.object(reporters, 'fig_counter', 0), mock.patch.object(reporters, 'tab_counter', 0), \
+       contextlib.redirect_stdout(io.StringIO()) as printed:
+    compare_mt_main.main()
+  return printed.getvalue()
+
+
+class TestNumWorkers(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(self):
+    example_path = os.path.join(compare_mt_root, "example")
+    ex = lambda name: os.path.join(example_path, name)
+    self.args = [
+      ex("ted.ref.eng"), ex("ted.sys1.eng"), ex("ted.sys2.eng"),
+      "--compare_scores", "score_type=bleu",
+      "--compare_word_accuracies",
+      f"bucket_type=label,ref_labels={ex('ted.ref.eng.tag')},"
+      f"out_labels={ex('ted.sys1.eng.tag')};{ex('ted.sys2.eng.tag')},label_set=DT+IN+NN+PRP",
+      f"bucket_type=multilabel,ref_labels={ex('ted.ref.eng.tag')},"
+      f"out_labels={ex('ted.sys1.eng.tag')};{ex('ted.sys2.eng.tag')},label_set=DT+IN+NN+PRP",
+      "--compare_sentence_buckets",
+      f"bucket_type=label,out_labels={ex('ted.sys1.eng.senttag')};{ex('ted.sys2.eng.senttag')},label_set=0+10+20",
+      "--compare_ngrams",
+      f"compare_type=match,ref_labels={ex('ted.ref.eng.tag')},out_labels={ex('ted.sys1.eng.tag')};{ex('ted.sys2.eng.tag')}",
+      "compare_type=over,case_insensitive=True",
+      "--compare_sentence_examples", "score_type=sentbleu,report_length=3",
+    ]
+
+  def test_label_bucketers(self):
+    serial = _run_main(self.args + ["--num_workers", "1"])
+    parallel = _run_main(self.args + ["--num_workers", "2"])
+    self.assertIn('DT', serial)
+    self.assertEqual(serial, parallel)
+
+  def test_figure_names(self):
+    with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+      _run_main(self.args + ["--num_workers", "1", "--output_directory", serial_dir])
+      _run_main(self.args + ["--num_workers", "2", "--output_directory", parallel_dir])
+      self.assertEqual(sorted(os.listdir(serial_dir)), sorted(os.listdir(parallel_dir)))
+      with open(os.path.join(serial_dir, "index.html")) as f_serial, \
+           open(os.path.join(parallel_dir, "index.html")) as f_parallel:
+        self.assertEqual(f_serial.read(), f_parallel.read())
+
+  def test_seed(self):
+    # Reports share one stream of random numbers, so bootstrap intervals match a serial run
+    args = self.args + ["--compare_scores", "score_type=bleu,bootstrap=10", "--seed", "1"]
+    self.assertEqual(_run_main(args + ["--num_workers", "1"]), _run_main(args + ["--num_workers", "2"]))
+
+
+if __name__ == "__main__":
+  unittest.main()
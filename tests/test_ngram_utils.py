@@ -0,0 +1,48 @@
+import os.path
+import unittest
+import sys
+
+compare_mt_root = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+sys.path.append(compare_mt_root)
+
+from compare_mt import ngram_utils
+from compare_mt.corpus_utils import load_tokens
+
+
+def _get_example_data():
+  example_path = os.path.join(compare_mt_root, "example")
+  ref_file = os.path.join(example_path, "ted.ref.eng")
+  out1_file = os.path.join(example_path, "ted.sys1.eng")
+  out2_file = os.path.join(example_path, "ted.sys2.eng")
+  return [load_tokens(x)[:300] for x in (ref_file, out1_file, out2_file)]
+
+
+class TestCompareNgrams(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(self):
+    ref, out1, out2 = _get_example_data()
+    # Add empty sentences, on either side and on both sides
+    self.ref = ref + [[], ['a', 'b', 'a', 'b'], []]
+    self.outs = [out1 + [['a', 'b'], [], []], out2 + [[], ['b', 'a', 'b', 'a', 'b'], []]]
+
+  def test_ids_match_labeled(self):
+    # Labeling every word with itself gives the same statistics through the pure-Python path
+    ref_labels = [list(s) for s in self.ref]
+    out_labels = [[list(s) for s in out] for out in self.outs]
+    for min_length, max_length in ((1, 1), (1, 4), (2, 3), (3, 5), (4, 4), (5, 2)):
+      ids = ngram_utils.compare_ngrams_multi(self.ref, self.outs, min_length=min_length, max_length=max_length)
+      labeled = ngram_utils.compare_ngrams_multi(self.ref, self.outs, ref_labels=ref_labels, out_labels=out_labels,
+                                                 min_length=min_length, max_length=max_length)
+      self.assertEqual(ids, labeled, f'min_length={min_length}, max_length={max_length}')
+
+  def test_compare_ngrams(self):
+    total, match, over, under = ngram_utils.compare_ngrams([['a', 'b', 'a']], [['a', 'a', 'c']], max_length=2)
+    self.assertEqual(total, {('a',): 2, ('c',): 1, ('a', 'a'): 1, ('a', 'c'): 1})
+    self.assertEqual(match, {('a',): 2})
+    self.assertEqual(over, {('c',): 1, ('a', 'a'): 1, ('a', 'c'): 1})
+    self.assertEqual(under, {('b',): 1, ('a', 'b'): 1, ('b', 'a'): 1})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -124,6 +124,15 @@ class TestRibesScorer(unittest.TestCase):
     ribes_corpus, _ = self.scorer.score_corpus(self.ref, self.out)
     self.assertAlmostEqual(ribes_corpus, 80.0020, 4)
 
+  def test_kendall_tau_distance(self):
+    rng = np.random.RandomState(0)
+    for n in (0, 1, 2, 7, 50):
+      alignment = list(rng.randint(0, 10, size=n))
+      ascending = sum(1 for i in range(n) for j in range(i+1, n) if alignment[j] > alignment[i])
+      expected = 2*ascending/(n*n-n) if n > 1 else 0
+      self.assertAlmostEqual(self.scorer._kendall_tau_distance(alignment), expected)
+    self.assertEqual(self.scorer._kendall_tau_distance(list(range(5))), 1.0)
+
 
 class TestChrFScorer(unittest.TestCase):
 